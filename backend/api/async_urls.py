@@ -0,0 +1,20 @@
+from django.urls import path
+
+from . import async_views
+
+app_name = 'api_async'
+
+urlpatterns = [
+    path('recipes/', async_views.recipe_list, name='recipes-list'),
+    path('recipes/<int:pk>/', async_views.recipe_detail,
+         name='recipes-detail'),
+    path('recipes/download_shopping_cart/',
+         async_views.download_shopping_cart,
+         name='recipes-download-shopping-cart'),
+    path('tags/', async_views.tag_list, name='tags-list'),
+    path('tags/<int:pk>/', async_views.tag_detail, name='tags-detail'),
+    path('ingredients/', async_views.ingredient_list,
+         name='ingredients-list'),
+    path('ingredients/<int:pk>/', async_views.ingredient_detail,
+         name='ingredients-detail'),
+]
@@ -0,0 +1,156 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from recipes import reference
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient, Recipe, ShoppingListItem
+
+from .filters import trigram_search
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def async_read_view(sync_view, sync_params=('format', )):
+    """GET обрабатывает асинхронное представление, остальное - sync_view.
+
+    В sync_view уходят и GET-запросы с параметрами из sync_params,
+    например format=api для браузерной версии API. Для GET создаётся
+    экземпляр того же представления DRF: аутентификация, согласование
+    формата, права, ограничение частоты запросов, ответы с ошибками
+    и отрисовка ответа берутся из него, а асинхронное представление
+    получает этот экземпляр и запрос DRF.
+    """
+    async_sync_view = sync_to_async(sync_view)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET'
+                    or any(param in request.GET for param in sync_params)):
+                return await async_sync_view(request, *args, **kwargs)
+            drf_view = sync_view.cls(**sync_view.initkwargs)
+            drf_view.action_map = {'head': sync_view.actions['get'],
+                                   **sync_view.actions}
+            for method, action in drf_view.action_map.items():
+                setattr(drf_view, method, getattr(drf_view, action))
+            drf_view.args, drf_view.kwargs = args, kwargs
+            request = drf_view.request = drf_view.initialize_request(
+                request, *args, **kwargs)
+            drf_view.headers = drf_view.default_response_headers
+            try:
+                await sync_to_async(drf_view.initial)(
+                    request, *args, **kwargs)
+                response = await view(drf_view, request, *args, **kwargs)
+            except Exception as error:
+                response = drf_view.handle_exception(error)
+
+            return drf_view.finalize_response(
+                request, response, *args, **kwargs)
+
+        wrapper.csrf_exempt = True
+
+        return wrapper
+
+    return decorator
+
+
+async def reference_response(view, request, get_data):
+    """ReferenceDataMixin.cached_response в потоке для sync-кода."""
+    return await sync_to_async(view.cached_response)(request, get_data)
+
+
+@async_read_view(RecipeViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def recipe_list(view, request):
+    queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+    page = await view.paginator.apaginate_queryset(queryset, request)
+
+    return view.get_paginated_response(
+        view.get_serializer(page, many=True).data)
+
+
+@async_read_view(RecipeViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+    'delete': 'destroy'}))
+async def recipe_detail(view, request, pk):
+    try:
+        recipe = await view.get_queryset().aget(pk=pk)
+    except Recipe.DoesNotExist:
+        raise NotFound
+    await sync_to_async(view.check_object_permissions)(request, recipe)
+
+    return Response(view.get_serializer(recipe).data)
+
+
+@async_read_view(
+    RecipeViewSet.as_view({'get': 'make_shopping_list'},
+                          **RecipeViewSet.make_shopping_list.kwargs),
+    sync_params=())
+async def download_shopping_cart(view, request):
+    renderer = request.accepted_renderer
+    items = ShoppingListItem.objects.filter(user=request.user)
+    etag = view.shopping_list_etag(renderer, await items.aaggregate(
+        count=Count('id'), updated=Max('updated')))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = view.download_shopping_list(renderer.astream(
+            view.shopping_list_rows(items).aiterator()), renderer)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
+
+
+@async_read_view(TagViewSet.as_view({'get': 'list'}),
+                 sync_params=('format', 'search'))
+async def tag_list(view, request):
+    return await reference_response(
+        view, request,
+        lambda: view.get_serializer(reference.tags.all(), many=True).data)
+
+
+@async_read_view(TagViewSet.as_view({'get': 'retrieve'}))
+async def tag_detail(view, request, pk):
+    tag = await sync_to_async(reference.tags.get)(pk)
+    if tag is None:
+        raise NotFound
+
+    return await reference_response(
+        view, request, lambda: view.get_serializer(tag).data)
+
+
+@async_read_view(IngredientViewSet.as_view({'get': 'list'}))
+async def ingredient_list(view, request):
+    limit = settings.INGREDIENT_SEARCH_LIMIT
+    name = request.query_params.get('name')
+    if name:
+        ingredients = await sync_to_async(ingredient_index.search)(
+            name, limit)
+        if not ingredients:
+            ingredients = [ingredient async for ingredient in trigram_search(
+                Ingredient.objects.all(), 'name', name)[:limit]]
+        return Response(view.get_serializer(ingredients, many=True).data)
+    if 'search' in request.query_params:
+        queryset = await sync_to_async(view.filter_queryset)(
+            view.get_queryset())
+        return Response(view.get_serializer(
+            [ingredient async for ingredient in queryset], many=True).data)
+
+    return await reference_response(
+        view, request,
+        lambda: view.get_serializer(
+            reference.ingredients.all(), many=True).data)
+
+
+@async_read_view(IngredientViewSet.as_view({'get': 'retrieve'}))
+async def ingredient_detail(view, request, pk):
+    ingredient = await sync_to_async(reference.ingredients.get)(pk)
+    if ingredient is None:
+        raise NotFound
+
+    return await reference_response(
+        view, request, lambda: view.get_serializer(ingredient).data)
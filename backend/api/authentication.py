@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from copy import copy
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import SAFE_METHODS
+
+
+class TokenCache:
+    """Пользователь по ключу токена в кэше процесса и в общем кэше.
+
+    Общий кэш очищается сигналами при выходе, смене пароля и любом другом
+    сохранении пользователя. Кэш процесса очищается так только в своём
+    процессе, поэтому живёт TOKEN_CACHE_LOCAL_TIMEOUT секунд и хранит
+    не больше size записей. Без REDIS_URL общий кэш не используется
+    (TOKEN_CACHE_TIMEOUT = 0): кэш в памяти есть у каждого воркера свой,
+    и сигналы не сбросили бы его в остальных воркерах.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._lock = Lock()
+        self._local = OrderedDict()
+
+    @staticmethod
+    def cache_key(key):
+        return f'auth-token:{sha256(key.encode()).hexdigest()}'
+
+    def _get_local(self, cache_key):
+        with self._lock:
+            expires, user = self._local.get(cache_key, (0, None))
+            if expires < monotonic():
+                self._local.pop(cache_key, None)
+                return None
+            self._local.move_to_end(cache_key)
+
+        return copy(user)
+
+    def _set_local(self, cache_key, user):
+        if not settings.TOKEN_CACHE_LOCAL_TIMEOUT:
+            return
+        with self._lock:
+            self._local[cache_key] = (
+                monotonic() + settings.TOKEN_CACHE_LOCAL_TIMEOUT, user)
+            self._local.move_to_end(cache_key)
+            if len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        cache_key = self.cache_key(key)
+        user = self._get_local(cache_key)
+        if user is None and settings.TOKEN_CACHE_TIMEOUT:
+            user = cache.get(cache_key)
+            if user is not None:
+                self._set_local(cache_key, copy(user))
+
+        return user
+
+    def set(self, key, user):
+        cache_key = self.cache_key(key)
+        if settings.TOKEN_CACHE_TIMEOUT:
+            cache.set(cache_key, user, settings.TOKEN_CACHE_TIMEOUT)
+        self._set_local(cache_key, copy(user))
+
+    def invalidate(self, keys):
+        cache_keys = [self.cache_key(key) for key in keys]
+        with self._lock:
+            for cache_key in cache_keys:
+                self._local.pop(cache_key, None)
+        if settings.TOKEN_CACHE_TIMEOUT:
+            cache.delete_many(cache_keys)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе, пока токен есть в кэше.
+
+    Кэш используется только для чтения: запросы с записью получают
+    пользователя из базы, потому что djoser и сериализаторы сохраняют
+    request.user, а снимок в кэше мог устареть.
+    """
+
+    def authenticate(self, request):
+        if request.method in SAFE_METHODS:
+            return super().authenticate(request)
+        return TokenAuthentication().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is not None:
+            # user_id, а не user: присваивание связи спрашивает у роутера
+            # базу для записи и прикрепило бы клиента к основной базе.
+            return user, self.get_model()(key=key, user_id=user.pk)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user)
+
+        return user, token
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+DB_POOL_MODES = ('direct', 'pgbouncer')
+
+
+@register()
+def check_database_pool(app_configs, **kwargs):
+    """Настройки соединений с базой против числа воркеров и потоков."""
+    if settings.DB_POOL_MODE not in DB_POOL_MODES:
+        return [Error(
+            f'Неизвестный DB_POOL_MODE: {settings.DB_POOL_MODE}',
+            hint=f'Допустимые значения: {", ".join(DB_POOL_MODES)}',
+            id='api.E001')]
+    if (settings.DB_POOL_MODE == 'pgbouncer'
+            or 'postgresql' not in settings.DATABASES['default']['ENGINE']):
+        return []
+    errors = []
+    connections = settings.GUNICORN_WORKERS * settings.DB_POOL_SIZE
+    if connections > settings.DB_MAX_CONNECTIONS:
+        errors.append(Warning(
+            f'Воркеры gunicorn могут открыть {connections} соединений, '
+            f'больше DB_MAX_CONNECTIONS ({settings.DB_MAX_CONNECTIONS})',
+            hint='Уменьшите GUNICORN_WORKERS или GUNICORN_THREADS '
+                 'либо включите DB_POOL_MODE=pgbouncer',
+            id='api.W001'))
+    if settings.ASYNC_VIEWS:
+        errors.append(Warning(
+            'В режиме ASGI соединения не сохраняются между запросами, '
+            'и каждый запрос открывает новое соединение с Postgres',
+            hint='Включите DB_POOL_MODE=pgbouncer',
+            id='api.W002'))
+
+    return errors
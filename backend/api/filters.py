@@ -1,36 +1,102 @@
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.filters import SearchFilter
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes import reference
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            TagRecipe)
+
+
+def tag_slug_choices():
+    return [(slug, slug) for slug in reference.tags.index('slug')]
+
+
+def trigram_search(queryset, field, value):
+    """Нечёткий поиск по триграммам pg_trgm, самые похожие первыми.
+
+    Находит значения с опечатками в value, на базах, кроме Postgres,
+    ищет подстроку без учёта регистра.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.filter(**{f'{field}__icontains': value})
+
+    return queryset.filter(
+        **{f'{field}__trigram_word_similar': value},
+    ).annotate(
+        similarity=TrigramWordSimilarity(value, field),
+    ).order_by('-similarity', field)
+
+
+class TrigramSearchFilter(SearchFilter):
+    """SearchFilter с нечётким поиском по первому из search_fields."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+        field = self.get_search_fields(view, request)[0]
+
+        return trigram_search(queryset, field, ' '.join(terms))
 
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(lookup_expr='istartswith')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Ingredient
         fields = ('name', )
 
+    def filter_search(self, queryset, name, value):
+        return trigram_search(
+            queryset, 'name', value)[:settings.INGREDIENT_SEARCH_LIMIT]
+
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_slug_choices,
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'Сначала популярные'), ),
+        method='filter_ordering')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author', )
 
+    def __init__(self, data=None, *args, **kwargs):
+        if data is not None:
+            reference.tags.refresh('slug', data.getlist('tags'))
+        super().__init__(data, *args, **kwargs)
+
+    def filter_tags(self, queryset, name, value):
+        tags = reference.tags.index('slug')
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tags[slug].id for slug in value])))
+
     def filter_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.popular()
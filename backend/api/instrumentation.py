@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import random
+from collections import Counter, defaultdict
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from hashlib import sha1
+from threading import Lock
+from time import perf_counter
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+SAMPLED_COUNTERS = ('requests', 'queries', 'duplicate_queries',
+                    'db_seconds', 'serializer_seconds')
+
+CONNECTION_COUNTERS = ('checkouts', 'waits', 'reconnects')
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def execute_wrappers(wrapper):
+    """Подключает wrapper ко всем соединениям текущего потока."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield wrapper
+
+
+@asynccontextmanager
+async def async_execute_wrappers(wrapper):
+    """execute_wrappers для асинхронного запроса.
+
+    Async ORM выполняет SQL в потоке, закреплённом за запросом, поэтому
+    обёртки подключаются к соединениям этого потока, а не цикла событий.
+    """
+    manager = execute_wrappers(wrapper)
+    await sync_to_async(manager.__enter__)()
+    try:
+        yield wrapper
+    finally:
+        await sync_to_async(manager.__exit__)(None, None, None)
+
+
+def fingerprint(sql):
+    return sha1(sql.encode()).hexdigest()[:12]
+
+
+class RequestMetrics:
+    """SQL-запросы и время сериализации одного запроса.
+
+    Подключается к соединениям через execute_wrapper, поэтому работает
+    и без DEBUG. Одинаковый текст SQL с разными параметрами считается
+    одним отпечатком.
+    """
+
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_count(self):
+        return sum(count - 1 for count in self.queries.values() if count > 1)
+
+    def duplicates(self):
+        return [{'fingerprint': fingerprint(sql), 'count': count,
+                 'sql': sql[:200]}
+                for sql, count in self.queries.most_common() if count > 1]
+
+
+def serializer_data(serializer):
+    """serializer.data с учётом времени сериализации в метриках запроса.
+
+    Вложенные вызовы входят во время верхнего уровня.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        return serializer.data
+    metrics.serializing = True
+    started = perf_counter()
+    try:
+        return serializer.data
+    finally:
+        metrics.serializing = False
+        metrics.serializer_time += perf_counter() - started
+
+
+class TimedSerializer:
+    """Обёртка сериализатора, чьё свойство data учитывается в метриках."""
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+    @property
+    def data(self):
+        return serializer_data(self.serializer)
+
+
+class SerializerTimingMixin:
+    """Примесь к представлениям: время сериализации ответа в метриках.
+
+    Для запросов вне выборки сериализатор возвращается без обёртки.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if _current.get() is None:
+            return serializer
+        return TimedSerializer(serializer)
+
+
+def count_connects(sender, connection, **kwargs):
+    """Учитывает новое соединение, открытия которого ждал запрос."""
+    registry.observe_connect(
+        connection.alias,
+        reconnect=(getattr(connection, 'connected_before', False)
+                   and connection.settings_dict['CONN_MAX_AGE'] != 0))
+    connection.connected_before = True
+
+
+def count_checkouts(sender, **kwargs):
+    """Учитывает соединения потока, оставшиеся от прошлых запросов.
+
+    Вызывается после close_old_connections, поэтому открытыми остаются
+    только постоянные соединения, которые запрос получит без ожидания.
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            registry.observe_checkout(connection.alias)
+
+
+class MetricsRegistry:
+    """Счётчики запросов в памяти процесса в формате Prometheus.
+
+    У каждого воркера gunicorn свои счётчики, поэтому в метки входит
+    pid процесса.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = Counter()
+        self.durations = {}
+        self.sampled = defaultdict(Counter)
+        self.connections = defaultdict(Counter)
+
+    def observe(self, view, method, status, duration, metrics=None):
+        with self._lock:
+            self.requests[view, method, status] += 1
+            histogram = self.durations.setdefault(
+                view, {'buckets': [0] * len(DURATION_BUCKETS),
+                       'count': 0, 'sum': 0})
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += duration
+            if metrics is not None:
+                sampled = self.sampled[view]
+                sampled['requests'] += 1
+                sampled['queries'] += metrics.query_count
+                sampled['duplicate_queries'] += metrics.duplicate_count
+                sampled['db_seconds'] += metrics.db_time
+                sampled['serializer_seconds'] += metrics.serializer_time
+
+    def observe_checkout(self, alias):
+        with self._lock:
+            self.connections[alias]['checkouts'] += 1
+
+    def observe_connect(self, alias, reconnect=False):
+        """Новое соединение: запрос к базе ждёт его открытия."""
+        with self._lock:
+            counters = self.connections[alias]
+            counters['checkouts'] += 1
+            counters['waits'] += 1
+            counters['reconnects'] += reconnect
+
+    def render(self):
+        worker = f'worker="{os.getpid()}"'
+        with self._lock:
+            lines = ['# TYPE foodgram_requests_total counter']
+            lines.extend(
+                f'foodgram_requests_total{{{worker},view="{view}",'
+                f'method="{method}",status="{status}"}} {count}'
+                for (view, method, status), count in self.requests.items())
+            lines.append(
+                '# TYPE foodgram_request_duration_seconds histogram')
+            for view, histogram in self.durations.items():
+                name = 'foodgram_request_duration_seconds'
+                labels = f'{worker},view="{view}"'
+                lines.extend(
+                    f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+                    for bound, count
+                    in zip(DURATION_BUCKETS, histogram['buckets']))
+                lines += [
+                    f'{name}_bucket{{{labels},le="+Inf"}} '
+                    f'{histogram["count"]}',
+                    f'{name}_count{{{labels}}} {histogram["count"]}',
+                    f'{name}_sum{{{labels}}} {histogram["sum"]:.6f}',
+                ]
+            for key in SAMPLED_COUNTERS:
+                name = f'foodgram_sampled_{key}_total'
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(
+                    f'{name}{{{worker},view="{view}"}} {values[key]:g}'
+                    for view, values in self.sampled.items())
+            lines.append('# TYPE foodgram_db_pool_size gauge')
+            lines.append(
+                f'foodgram_db_pool_size{{{worker}}} {settings.DB_POOL_SIZE}')
+            for key in CONNECTION_COUNTERS:
+                name = f'foodgram_db_{key}_total'
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(
+                    f'{name}{{{worker},alias="{alias}"}} {values[key]:g}'
+                    for alias, values in self.connections.items())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus."""
+    return HttpResponse(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+class InstrumentationMiddleware:
+    """Время ответа, SQL-запросы и время сериализации каждого запроса.
+
+    Все запросы и соединения с базой учитываются в счётчиках /metrics. Доля
+    INSTRUMENTATION_SAMPLE_RATE запросов дополнительно проходит через
+    RequestMetrics: для них добавляется заголовок Server-Timing и пишется
+    строка JSON в лог api.instrumentation. При нулевой доле остаётся
+    только замер общего времени.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        request_started.connect(
+            count_checkouts, dispatch_uid='api.instrumentation')
+        connection_created.connect(
+            count_connects, dispatch_uid='api.instrumentation')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = perf_counter()
+        metrics = self.sample()
+        if metrics is None:
+            response = self.get_response(request)
+        else:
+            token = _current.set(metrics)
+            try:
+                with execute_wrappers(metrics):
+                    response = self.get_response(request)
+            finally:
+                _current.reset(token)
+        self.observe(request, response, perf_counter() - started, metrics)
+
+        return response
+
+    async def __acall__(self, request):
+        started = perf_counter()
+        metrics = self.sample()
+        if metrics is None:
+            response = await self.get_response(request)
+        else:
+            token = _current.set(metrics)
+            try:
+                async with async_execute_wrappers(metrics):
+                    response = await self.get_response(request)
+            finally:
+                _current.reset(token)
+        self.observe(request, response, perf_counter() - started, metrics)
+
+        return response
+
+    @staticmethod
+    def sample():
+        if random.random() < settings.INSTRUMENTATION_SAMPLE_RATE:
+            return RequestMetrics()
+        return None
+
+    def observe(self, request, response, duration, metrics):
+        match = request.resolver_match
+        view = match.view_name if match else 'unknown'
+        registry.observe(view, request.method, response.status_code,
+                         duration, metrics)
+        if metrics is not None:
+            self.report(request, response, view, duration, metrics)
+
+    @staticmethod
+    def report(request, response, view, duration, metrics):
+        duplicates = metrics.duplicates()
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.query_count} queries, '
+            f'{len(duplicates)} duplicated"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'queries': metrics.query_count,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+            'duplicates': duplicates,
+        }, ensure_ascii=False))
@@ -0,0 +1,164 @@
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.test import override_settings
+from rest_framework.serializers import Serializer
+
+from .instrumentation import async_execute_wrappers, execute_wrappers
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_LISTS = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))*\)')
+NUMBERS = re.compile(r'\b\d+\b')
+SPACES = re.compile(r'\s+')
+
+TO_REPRESENTATION = Serializer.to_representation.__code__
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def normalize(sql):
+    """Шаблон запроса: без литералов чисел и длины списков в IN (...)."""
+    sql = PLACEHOLDER_LISTS.sub('(...)', sql)
+    sql = NUMBERS.sub('?', sql)
+
+    return SPACES.sub(' ', sql).strip()
+
+
+def field_stack():
+    """Цепочка полей сериализаторов, которые сейчас выполняются."""
+    stack = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code is TO_REPRESENTATION:
+            field = frame.f_locals.get('field')
+            if field is not None:
+                stack.append(f'{type(frame.f_locals["self"]).__name__}.'
+                             f'{field.field_name}')
+        frame = frame.f_back
+
+    return ' > '.join(reversed(stack)) or '-'
+
+
+class QueryPatternDetector:
+    """Поиск одинаковых запросов, повторяющихся внутри одного запроса API.
+
+    Выполненный SQL группируется по шаблону (см. normalize). Когда шаблон
+    выполняется больше threshold раз, запоминается цепочка полей
+    сериализаторов, из которых он был вызван. Шаблоны, содержащие одну
+    из подстрок allowlist, не учитываются.
+    """
+
+    def __init__(self, threshold=None, allowlist=()):
+        self.threshold = threshold or settings.NPLUSONE_THRESHOLD
+        self.allowlist = tuple(allowlist)
+        self.templates = Counter()
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        template = normalize(sql)
+        self.templates[template] += 1
+        if (self.templates[template] == self.threshold + 1
+                and template not in self.stacks):
+            self.stacks[template] = field_stack()
+
+        return execute(sql, params, many, context)
+
+    def watch(self):
+        return execute_wrappers(self)
+
+    def violations(self):
+        return [(template, self.templates[template], stack)
+                for template, stack in self.stacks.items()
+                if not any(pattern in template
+                           for pattern in self.allowlist)]
+
+    def report(self, title):
+        return '\n'.join(
+            [title] + [f'{count} раз: {template}\n  поле: {stack}'
+                       for template, count, stack in self.violations()])
+
+
+class NPlusOneMiddleware:
+    """Предупреждение об N+1 в запросах к API.
+
+    Включается NPLUSONE_DETECTION (по умолчанию в режиме DEBUG). Найденные
+    повторы пишутся в лог api.nplusone, а при NPLUSONE_RAISE=True
+    поднимается NPlusOneError. Допустимые повторы задаются атрибутом
+    nplusone_allowlist класса представления.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.NPLUSONE_DETECTION:
+            return self.get_response(request)
+        detector = request.query_patterns = QueryPatternDetector()
+        with detector.watch():
+            response = self.get_response(request)
+
+        return self.check(request, response, detector)
+
+    async def __acall__(self, request):
+        if not settings.NPLUSONE_DETECTION:
+            return await self.get_response(request)
+        detector = request.query_patterns = QueryPatternDetector()
+        async with async_execute_wrappers(detector):
+            response = await self.get_response(request)
+
+        return self.check(request, response, detector)
+
+    @staticmethod
+    def check(request, response, detector):
+        if detector.violations():
+            message = detector.report(
+                f'N+1 в {request.method} {request.get_full_path()} '
+                f'({response.status_code})')
+            if settings.NPLUSONE_RAISE:
+                raise NPlusOneError(message)
+            logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, 'query_patterns'):
+            request.query_patterns.allowlist = getattr(
+                getattr(view_func, 'cls', None), 'nplusone_allowlist', ())
+
+
+class NPlusOneTestMixin:
+    """Примесь к тестам: N+1 в любом запросе тестового клиента - ошибка.
+
+    assertNoNPlusOne проверяет код, выполняемый вне запросов к API.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        nplusone_settings = override_settings(
+            NPLUSONE_DETECTION=True, NPLUSONE_RAISE=True)
+        nplusone_settings.enable()
+        cls.addClassCleanup(nplusone_settings.disable)
+
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=None, allowlist=()):  # noqa: N802
+        detector = QueryPatternDetector(threshold, allowlist)
+        with detector.watch():
+            yield detector
+        if detector.violations():
+            raise self.failureException(detector.report('N+1'))
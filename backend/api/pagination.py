@@ -1,6 +1,196 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка количества строк по плану запроса Postgres.
+
+    На остальных базах возвращает точное количество.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']['Plan Rows']
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная навигация по номеру страницы или по курсору.
+
+    Если в запросе есть параметр cursor (для первой страницы - пустой),
+    страницы выбираются по ключу сортировки queryset с добавленным id,
+    без OFFSET и без COUNT(*). Параметр count=exact|estimate добавляет
+    в ответ точное или оценочное количество объектов. Если queryset
+    отсортирован по аннотации (например, по релевантности поиска),
+    курсор игнорируется и используется номер страницы.
+    """
+
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = (self.cursor_query_param in request.query_params
+                       and not self.ordered_by_annotation(queryset))
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        queryset = self.keyset_queryset(queryset, request)
+        self.count = self.get_count(queryset, request)
+        queryset = self.after_cursor(queryset, request)
+        page_size = self.get_page_size(request)
+
+        return self.keyset_page(list(queryset[:page_size + 1]), page_size)
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset для async-представлений на async ORM."""
+        self.keyset = (self.cursor_query_param in request.query_params
+                       and not self.ordered_by_annotation(queryset))
+        page_size = self.get_page_size(request)
+        if self.keyset:
+            queryset = self.keyset_queryset(queryset, request)
+            self.count = await self.aget_count(queryset, request)
+            queryset = self.after_cursor(queryset, request)
+            page = [obj async for obj in queryset[:page_size + 1]]
+            return self.keyset_page(page, page_size)
+
+        self.request = request
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as error:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(error)))
+        self.page.object_list = [obj async for obj in self.page.object_list]
+
+        return list(self.page)
+
+    def keyset_queryset(self, queryset, request):
+        """queryset, отсортированный по ключу курсора."""
+        self.request = request
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+
+        return queryset.order_by(*(
+            f'-{name}' if descending else name
+            for name, descending in self.ordering))
+
+    def after_cursor(self, queryset, request):
+        """Строки после курсора; количество считается до этого фильтра."""
+        cursor = request.query_params[self.cursor_query_param]
+        if not cursor:
+            return queryset
+
+        return queryset.filter(self.after(self.decode_cursor(cursor)))
+
+    def keyset_page(self, page, page_size):
+        self.next_values = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_values = [
+                self.model._meta.get_field(name).value_to_string(page[-1])
+                for name, _ in self.ordering]
+
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_values is None:
+            return None
+        cursor = urlsafe_b64encode(
+            json.dumps(self.next_values).encode()).decode()
+
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            cursor)
+
+    @staticmethod
+    def ordered_by_annotation(queryset):
+        return any(isinstance(name, str)
+                   and name.lstrip('-') in queryset.query.annotations
+                   for name in queryset.query.order_by)
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = [
+            (name.lstrip('-'), name.startswith('-'))
+            for name in (queryset.query.order_by
+                         or queryset.model._meta.ordering)]
+        pk_name = queryset.model._meta.pk.name
+        if not {pk_name, 'pk'} & {name for name, _ in ordering}:
+            ordering.append((pk_name, ordering[-1][1] if ordering else False))
+
+        return [(pk_name if name == 'pk' else name, descending)
+                for name, descending in ordering]
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    async def aget_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return await queryset.acount()
+        if mode == 'estimate':
+            return await sync_to_async(estimate_count)(queryset)
+        return None
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return values
+        except (BinasciiError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, values):
+        """Условие «строго после» для составного ключа сортировки."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            try:
+                value = self.model._meta.get_field(name).to_python(value)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+
+        return condition
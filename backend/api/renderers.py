@@ -0,0 +1,99 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу отдаёт записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListStreamMixin:
+    """Потоковая выдача списка покупок: заголовок, строки и окончание."""
+
+    def header(self):
+        return ''
+
+    def row(self, ingredient, index):
+        raise NotImplementedError
+
+    def footer(self):
+        return ''
+
+    def stream(self, ingredients):
+        yield self.header()
+        for index, ingredient in enumerate(ingredients):
+            yield self.row(ingredient, index)
+        yield self.footer()
+
+    async def astream(self, ingredients):
+        """stream для асинхронного итератора строк."""
+        yield self.header()
+        index = 0
+        async for ingredient in ingredients:
+            yield self.row(ingredient, index)
+            index += 1
+        yield self.footer()
+
+
+class ShoppingListTextRenderer(ShoppingListStreamMixin, BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return data
+
+    def header(self):
+        return 'Список покупок:\n'
+
+    def row(self, ingredient, index):
+        return (
+            f'\n  - {ingredient["ingredient__name"]}: '
+            f'{ingredient["amount"]} '
+            f'({ingredient["ingredient__measurement_unit"]})'
+        )
+
+
+class ShoppingListCSVRenderer(ShoppingListTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    writer = csv.writer(Echo())
+
+    def header(self):
+        return self.writer.writerow(('name', 'amount', 'measurement_unit'))
+
+    def row(self, ingredient, index):
+        return self.writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit'],
+        ))
+
+
+class ShoppingListJSONRenderer(ShoppingListStreamMixin, JSONRenderer):
+
+    def header(self):
+        return '['
+
+    def row(self, ingredient, index):
+        return (',' if index else '') + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'amount': ingredient['amount'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+
+    def footer(self):
+        return ']'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+)
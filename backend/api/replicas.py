@@ -0,0 +1,127 @@
+import random
+from contextvars import ContextVar
+from hashlib import sha1
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = 'default'
+
+# Модели, которые всегда читаются из основной базы.
+PRIMARY_MODELS = ('authtoken.Token', 'sessions.Session')
+
+# Из реплик читают только запросы к API: админка и сессии остаются
+# на основной базе.
+REPLICA_PATH_PREFIX = '/api/'
+
+_state = ContextVar('replica_routing', default=None)
+
+
+class RoutingState:
+    """Куда направлять чтение в рамках одного запроса к API.
+
+    Реплика выбирается одна на запрос: страница и её prefetch-запросы
+    не должны читаться из реплик с разным отставанием.
+    """
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica and bool(settings.DB_REPLICA_ALIASES)
+        self.replica = (random.choice(settings.DB_REPLICA_ALIASES)
+                        if self.use_replica else None)
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """Чтение из реплик для безопасных запросов, запись - в основную базу.
+
+    Реплики используются только внутри запросов, которые разрешил
+    ReplicaMiddleware. Первая запись переключает остаток запроса на
+    основную базу. Токены читаются из основной базы: только что выданный
+    токен мог ещё не дойти до реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is None or not state.use_replica
+                or model._meta.label in PRIMARY_MODELS):
+            return PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.use_replica = False
+            state.wrote = True
+
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = (PRIMARY, *settings.DB_REPLICA_ALIASES)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaMiddleware:
+    """Разрешает чтение из реплик для GET, HEAD и OPTIONS к API.
+
+    После запроса с записью клиент с тем же заголовком Authorization
+    DB_REPLICA_PIN_SECONDS секунд читает из основной базы, чтобы видеть
+    свои изменения, пока они доходят до реплик. Отметка хранится в кэше,
+    поэтому при нескольких воркерах нужен общий кэш (REDIS_URL).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def readable(request):
+        return (request.method in SAFE_METHODS
+                and request.path_info.startswith(REPLICA_PATH_PREFIX))
+
+    @staticmethod
+    def pin_key(request):
+        authorization = request.headers.get('Authorization')
+        if not authorization or not settings.DB_REPLICA_ALIASES:
+            return None
+        return f'replica-pin:{sha1(authorization.encode()).hexdigest()}'
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self.pin_key(request)
+        state = RoutingState(self.readable(request) and not (
+            key and cache.get(key)))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if key and state.wrote:
+            cache.set(key, True, settings.DB_REPLICA_PIN_SECONDS)
+
+        return response
+
+    async def __acall__(self, request):
+        key = self.pin_key(request)
+        state = RoutingState(self.readable(request) and not (
+            key and await cache.aget(key)))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        if key and state.wrote:
+            await cache.aset(key, True, settings.DB_REPLICA_PIN_SECONDS)
+
+        return response
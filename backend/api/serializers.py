@@ -1,10 +1,14 @@
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Case, Manager, Value, When
 from djoser.serializers import UserSerializer as CustomUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
+from recipes import reference
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
 from users.models import Subscribe, User
 
 
@@ -20,6 +24,30 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class UserListSerializer(serializers.ListSerializer):
+    """Список пользователей с подписками, найденными одним запросом.
+
+    Пользователям страницы без атрибута is_subscribed он проставляется
+    по одному запросу с author_id IN (...) к подпискам текущего
+    пользователя, и дочерний сериализатор берёт готовое значение.
+    """
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get('request')
+        unresolved = [user for user in users
+                      if not hasattr(user, 'is_subscribed')]
+        if unresolved and request and request.user.is_authenticated:
+            subscribed = set(Subscribe.objects.filter(
+                user=request.user,
+                author_id__in={user.id for user in unresolved},
+            ).values_list('author_id', flat=True))
+            for user in unresolved:
+                user.is_subscribed = user.id in subscribed
+
+        return super().to_representation(users)
+
+
 class UserSerializer(CustomUserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
@@ -27,15 +55,41 @@ class UserSerializer(CustomUserSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed')
+        list_serializer_class = UserListSerializer
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
 
         return (request and request.user.is_authenticated
                 and obj.following.filter(user=request.user).exists())
 
 
+class RecipeImageField(serializers.Field):
+    """Ссылка на уменьшенную копию изображения рецепта.
+
+    В списках отдаётся копия list_variant, для одного объекта - variant.
+    """
+
+    def __init__(self, variant, list_variant=None, **kwargs):
+        self.variant = variant
+        self.list_variant = list_variant or variant
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, recipe):
+        many = isinstance(self.parent.parent, serializers.ListSerializer)
+        url = recipe.image_url(self.list_variant if many else self.variant)
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+
+        return url
+
+
 class RecipeShortSerializer(serializers.ModelSerializer):
+    image = RecipeImageField('small')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -43,7 +97,6 @@ class RecipeShortSerializer(serializers.ModelSerializer):
 
 class SubscribeListSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
@@ -51,6 +104,8 @@ class SubscribeListSerializer(UserSerializer):
             'id', 'email', 'username', 'first_name', 'last_name')
 
     def get_recipes(self, obj):
+        if hasattr(obj, 'recipes_preview'):
+            return RecipeShortSerializer(obj.recipes_preview, many=True).data
         request = self.context.get('request')
         if not request:
             return False
@@ -61,9 +116,6 @@ class SubscribeListSerializer(UserSerializer):
 
         return RecipeShortSerializer(queryset, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class SubscribeSerializer(serializers.ModelSerializer):
 
@@ -100,26 +152,37 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     ingredients = serializers.SerializerMethodField()
     author = UserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None)
+    image = RecipeImageField('large', list_variant='card')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('thumbnails', 'favorites_count', 'in_carts_count',
+                   'search_vector')
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+
+        return super().to_representation(instance)
 
     def get_ingredients(self, obj):
-        ingredients = IngredientRecipe.objects.filter(recipe=obj).all()
+        ingredients = obj.recipe_ingredients.all()
 
         return IngredientRecipeReadSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
 
         return (request and request.user.is_authenticated
                 and obj.favorites.filter(user=request.user).exists())
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
 
         return (request and request.user.is_authenticated
@@ -127,8 +190,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
 
 
 class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
-    id = serializers.SlugRelatedField(
-        queryset=Ingredient.objects.all(), slug_field='id')
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(write_only=True, min_value=1)
 
     class Meta:
@@ -136,13 +198,44 @@ class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class CachedTagField(serializers.PrimaryKeyRelatedField):
+    """Тег по id из кэша справочников.
+
+    В базу идёт запрос, только если тега нет в кэше.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        tag = reference.tags.get(data)
+        if tag is None:
+            self.fail('does_not_exist', pk_value=data)
+
+        return tag
+
+
+class RecipeImageUploadField(Base64ImageField):
+    """Изображение строкой Base64 или файлом из multipart/form-data."""
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
+        image = serializers.ImageField.to_internal_value(self, data)
+        extension = image.image.format.lower()
+        if extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        image.name = f'{self.get_file_name(image)}.{extension}'
+
+        return image
+
+
 class RecipeWriteSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CachedTagField(
         queryset=Tag.objects.all(),
         many=True)
     ingredients = IngredientRecipeCreateSerializer(many=True)
     author = UserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None)
+    image = RecipeImageUploadField(max_length=None)
     cooking_time = serializers.IntegerField()
 
     class Meta:
@@ -151,34 +244,31 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time')
 
     def validate_tags(self, tags):
-        tags_list = []
         if not tags:
             raise serializers.ValidationError(
                 {'tags': 'Выберите хотя бы один тег'})
-        for tag in tags:
-            if not Tag.objects.filter(id=tag.id).exists():
-                raise serializers.ValidationError(
-                    'Нет такого тега')
-            if tag.id in tags_list:
-                raise serializers.ValidationError(
-                    'Теги не могут повторяться')
-            tags_list.append(tag.id)
+        if len({tag.id for tag in tags}) != len(tags):
+            raise serializers.ValidationError(
+                'Теги не могут повторяться')
 
         return tags
 
     def validate_ingredients(self, ingredients):
-        ingredients_list = []
         if not ingredients:
             raise serializers.ValidationError(
                 'Выберите хотя бы один ингредиент')
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не могут повторяться')
+        found = Ingredient.objects.in_bulk(ids)
+        missing = set(ids) - found.keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Нет ингредиентов с id: '
+                + ', '.join(map(str, sorted(missing))))
         for ingredient in ingredients:
-            if ingredient in ingredients_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты не могут повторяться')
-            ingredients_list.append(ingredient)
-            if int(ingredient.get('amount')) < 1:
-                raise serializers.ValidationError(
-                    'Укажите значение больше нуля')
+            ingredient['id'] = found[ingredient['id']]
 
         return ingredients
 
@@ -202,22 +292,54 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(author=request.user, **validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(recipe=recipe, ingredients=ingredients)
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
 
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Меняет только добавленные, удалённые и изменённые ингредиенты."""
+        old_amounts = recipe.ingredient_amounts()
+        new_amounts = {ingredient['id'].id: ingredient['amount']
+                       for ingredient in ingredients}
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        changed = {
+            ingredient_id: amount for ingredient_id, amount
+            in new_amounts.items()
+            if old_amounts.get(ingredient_id, amount) != amount}
+        if changed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=changed,
+            ).update(amount=Case(
+                *[When(ingredient_id=ingredient_id, then=Value(amount))
+                  for ingredient_id, amount in changed.items()]))
+        RecipeWriteSerializer.add_ingredients(recipe, [
+            ingredient for ingredient in ingredients
+            if ingredient['id'].id not in old_amounts])
+        ShoppingListItem.objects.apply_recipe_change(
+            recipe, old_amounts, new_amounts)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        ingredients = validated_data.pop('ingredients')
-        self.add_ingredients(recipe=instance, ingredients=ingredients)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        instance = super().update(instance, validated_data)
+        Recipe.objects.filter(pk=instance.pk).update_search_vector()
 
-        return super().update(instance, validated_data)
+        return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.with_user_annotations(
+            request.user).with_related().get(pk=instance.pk)
 
         return RecipeReadSerializer(instance, context=context).data
 
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+from .authentication import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """Смена пароля, деактивация и правка профиля сбрасывают кэш токенов."""
+    if not created:
+        token_cache.invalidate(Token.objects.filter(
+            user=instance).values_list('key', flat=True))
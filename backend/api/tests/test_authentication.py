@@ -0,0 +1,35 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from .utils import APIDataMixin
+
+
+class CachedTokenAuthenticationTest(APIDataMixin, APITestCase):
+    """Кэш токенов и его сброс при выходе и деактивации."""
+
+    authors_count = 1
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                self.client.get('/api/users/me/').status_code, 200)
+
+        return [query for query in queries
+                if 'authtoken_token' in query['sql']]
+
+    def test_cached_token_skips_database(self):
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(self.token_queries(), [])
+
+    def test_logout_invalidates_token(self):
+        self.token_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivation_invalidates_token(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
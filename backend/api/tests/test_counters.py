@@ -0,0 +1,55 @@
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscribe, User
+
+from .utils import APIDataMixin
+
+
+class CountersTest(APIDataMixin, APITestCase):
+    """Сохранение устаревшего экземпляра не затирает счётчики."""
+
+    authors_count = 1
+
+    def test_set_password_keeps_followers_count(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        Subscribe.objects.create(user=self.authors[0], author=self.user)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'user-password',
+            'new_password': 'new-user-password',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            User.objects.get(pk=self.user.pk).followers_count, 1)
+
+    def test_recipe_update_keeps_favorites_count(self):
+        author = self.authors[0]
+        recipe = Recipe.objects.filter(author=author).first()
+        stale = Recipe.objects.get(pk=recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        stale.name = 'Новое название'
+        stale.save()
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).favorites_count, 1)
+
+        author_token = Token.objects.create(user=author)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {author_token.key}')
+        response = self.client.patch(f'/api/recipes/{recipe.id}/', {
+            'name': 'Ещё одно название',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.name, 'Ещё одно название')
+
+    def test_user_deletion_updates_counters(self):
+        author = self.authors[0]
+        recipe = Recipe.objects.filter(author=author).first()
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.user.delete()
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 0)
+        self.assertEqual(User.objects.get(pk=author.pk).followers_count, 0)
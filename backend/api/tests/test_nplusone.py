@@ -0,0 +1,29 @@
+from rest_framework.test import APITestCase
+
+from api.nplusone import NPlusOneTestMixin
+
+from .utils import APIDataMixin
+
+
+class NPlusOneTest(NPlusOneTestMixin, APIDataMixin, APITestCase):
+    """Списки API без повторяющихся запросов на каждый объект страницы."""
+
+    def test_recipe_list(self):
+        for url in ('/api/recipes/?limit=20',
+                    '/api/recipes/?limit=20&is_favorited=1',
+                    '/api/recipes/?limit=20&cursor='):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_subscriptions(self):
+        for url in ('/api/users/subscriptions/?limit=20',
+                    '/api/users/subscriptions/?limit=20&recipes_limit=1'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_user_list(self):
+        response = self.client.get('/api/users/?limit=20')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sum(user['is_subscribed'] for user in response.data['results']),
+            self.authors_count)
@@ -0,0 +1,22 @@
+from rest_framework.test import APITestCase
+
+from recipes.models import Recipe
+
+from .utils import APIDataMixin
+
+
+class KeysetPaginationTest(APIDataMixin, APITestCase):
+    """Страницы по курсору и количество объектов в них."""
+
+    def test_count_is_the_same_on_every_page(self):
+        total = Recipe.objects.count()
+        url = '/api/recipes/?cursor=&count=exact'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], total)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-created', '-id').values_list('id', flat=True)))
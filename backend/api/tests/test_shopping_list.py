@@ -0,0 +1,73 @@
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from recipes.models import (Favorite, IngredientRecipe, Recipe, ShoppingCart,
+                            ShoppingListItem)
+
+from .utils import APIDataMixin
+
+
+class ShoppingListTest(APIDataMixin, APITestCase):
+    """Список покупок меняется на разницу, а не пересчитывается."""
+
+    def assertShoppingListConsistent(self):  # noqa: N802
+        expected = dict(IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user=self.user,
+        ).values('ingredient').annotate(
+            total=Sum('amount'),
+        ).values_list('ingredient', 'total'))
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient', 'amount')), expected)
+
+    def test_cart_and_recipe_changes(self):
+        first, second = Recipe.objects.filter(author=self.authors[0])
+        other = Recipe.objects.filter(author=self.authors[1]).first()
+        for recipe in (first, second, other):
+            response = self.client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+            self.assertShoppingListConsistent()
+
+        author_token = Token.objects.create(user=self.authors[0])
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {author_token.key}')
+        response = self.client.patch(f'/api/recipes/{first.id}/', {
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 30},
+                {'id': self.ingredients[5].id, 'amount': 7},
+            ],
+            'tags': [self.tags[0].id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListConsistent()
+
+        response = self.client.delete(f'/api/recipes/{second.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListConsistent()
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = self.client.delete(
+            f'/api/recipes/{first.id}/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListConsistent()
+
+    def delete_queries(self, recipe, users_count):
+        for index in range(users_count):
+            user = self.create_user(f'{recipe.id}-{index}')
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            Favorite.objects.create(user=user, recipe=recipe)
+        with CaptureQueriesContext(connection) as queries:
+            recipe.delete()
+
+        return len(queries)
+
+    def test_recipe_deletion_queries_do_not_depend_on_carts(self):
+        first, second = Recipe.objects.filter(author=self.authors[0])
+        self.assertEqual(self.delete_queries(first, 2),
+                         self.delete_queries(second, 6))
+        self.assertFalse(ShoppingListItem.objects.filter(
+            user__username__startswith=f'{first.id}-').exists())
@@ -0,0 +1,25 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from recipes.models import Recipe
+
+from .utils import GIF, APIDataMixin
+
+
+class UploadLimitTest(APIDataMixin, APITestCase):
+    """Ограничение размера файла в multipart-запросах к рецептам."""
+
+    authors_count = 1
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=len(GIF) - 1)
+    def test_large_image_is_rejected(self):
+        author = self.authors[0]
+        recipe = Recipe.objects.filter(author=author).first()
+        token = Token.objects.create(user=author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.patch(f'/api/recipes/{recipe.id}/', {
+            'image': SimpleUploadedFile('image.gif', GIF, 'image/gif'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 413)
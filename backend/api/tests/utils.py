@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import Subscribe, User
+
+GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x05\x04\x04\x00\x00\x00,\x00'
+       b'\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+
+class APIDataMixin:
+    """Теги, ингредиенты, авторы с рецептами и подписки для тестов API.
+
+    Изображения пишутся во временный каталог, уменьшенные копии
+    создаются сразу при сохранении.
+    """
+
+    authors_count = 8
+    recipes_per_author = 2
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root, RECIPE_IMAGE_WORKERS=0)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [Tag.objects.create(
+            name=f'Тег {index}', color=f'#00000{index}', slug=f'tag{index}')
+            for index in range(3)]
+        cls.ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(6)]
+        cls.user = cls.create_user('user')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.authors = [cls.create_user(f'author{index}')
+                       for index in range(cls.authors_count)]
+        for author in cls.authors:
+            Subscribe.objects.create(user=cls.user, author=author)
+            for index in range(cls.recipes_per_author):
+                cls.create_recipe(author, {
+                    cls.ingredients[index]: 100,
+                    cls.ingredients[index + 1]: 50,
+                })
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            email=f'{username}@example.com', username=username,
+            first_name='Имя', last_name='Фамилия',
+            password=f'{username}-password')
+
+    @classmethod
+    def create_recipe(cls, author, amounts):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Рецепт {author.username}', text='Текст',
+            cooking_time=10,
+            image=SimpleUploadedFile('image.gif', GIF, 'image/gif'))
+        recipe.tags.set(cls.tags[:2])
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()])
+
+        return recipe
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        token_cache.invalidate([self.token.key])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class FileTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'file_too_large'
+
+    def __init__(self):
+        super().__init__(
+            'Размер файла не должен превышать '
+            f'{filesizeformat(settings.UPLOAD_MAX_FILE_SIZE)}')
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Ограничение размера файлов в multipart/form-data.
+
+    RecipeViewSet ставит его первым в request.upload_handlers: только
+    DRF превращает FileTooLarge в ответ 413, в обычных представлениях
+    Django (например, в админке) это была бы ошибка 500. Запрос, чей
+    Content-Length больше допустимого, отклоняется до чтения тела, а файл
+    прерывается на первом фрагменте сверх UPLOAD_MAX_FILE_SIZE. Остальные
+    фрагменты передаются стандартным обработчикам: небольшие файлы
+    остаются в памяти, крупные по частям пишутся во временный файл
+    на диске.
+    """
+
+    def handle_raw_input(self, input_data, meta, content_length, boundary,
+                         encoding=None):
+        limit = (settings.UPLOAD_MAX_FILE_SIZE
+                 + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0))
+        if content_length > limit:
+            raise FileTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.UPLOAD_MAX_FILE_SIZE:
+            raise FileTooLarge()
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
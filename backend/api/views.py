@@ -1,45 +1,114 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import filters, status, viewsets
+from rest_framework import filters, serializers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes import reference
+from recipes.autocomplete import ingredient_index
+from recipes.models import (Favorite, FeedItem, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
 from users.models import Subscribe, User
 
-from .filters import IngredientFilter, RecipeFilter
+from .filters import (IngredientFilter, RecipeFilter, TrigramSearchFilter,
+                      trigram_search)
+from .instrumentation import SerializerTimingMixin, serializer_data
 from .pagination import CustomPagination
 from .permissions import IsAuthorOrReadOnly
+from .renderers import SHOPPING_LIST_RENDERERS
 from .serializers import (FavoriteSerializer, IngredientSerializer,
                           RecipeReadSerializer, RecipeWriteSerializer,
                           ShoppingCartSerializer, SubscribeListSerializer,
                           SubscribeSerializer, TagSerializer, UserSerializer)
+from .uploads import LimitedUploadHandler
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class ReferenceDataMixin:
+    """Список и объекты справочника из кэша с ETag и Cache-Control.
+
+    Запросы с параметрами из uncached_params идут в базу как обычно.
+    """
+
+    reference_data = None
+    uncached_params = ()
+
+    def cached_response(self, request, get_data):
+        etag = quote_etag(
+            f'{self.reference_data.key}-{self.reference_data.etag()}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(get_data())
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_DATA_MAX_AGE)
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if any(param in request.query_params
+               for param in self.uncached_params):
+            return super().list(request, *args, **kwargs)
+
+        return self.cached_response(request, lambda: self.get_serializer(
+            self.reference_data.all(), many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.reference_data.get(kwargs.get(self.lookup_field))
+        if instance is None:
+            raise NotFound
+
+        return self.cached_response(
+            request, lambda: self.get_serializer(instance).data)
+
+
+class TagViewSet(SerializerTimingMixin, ReferenceDataMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     filter_backends = (filters.SearchFilter, )
     search_fields = ('name', )
     pagination_class = None
+    reference_data = reference.tags
+    uncached_params = ('search', )
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(SerializerTimingMixin, ReferenceDataMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filterset_class = IngredientFilter
+    reference_data = reference.ingredients
+    uncached_params = ('search', )
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        ingredients = ingredient_index.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT)
+        if not ingredients:
+            ingredients = trigram_search(
+                Ingredient.objects.all(), 'name',
+                name)[:settings.INGREDIENT_SEARCH_LIMIT]
 
+        return Response(self.get_serializer(ingredients, many=True).data)
 
-class CustomUserViewSet(UserViewSet):
+
+class CustomUserViewSet(SerializerTimingMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = (filters.SearchFilter, )
+    filter_backends = (TrigramSearchFilter, )
     permission_classes = (IsAuthenticated, )
     pagination_class = CustomPagination
     search_fields = ('username', )
@@ -60,6 +129,7 @@ class CustomUserViewSet(UserViewSet):
 
     @action(detail=True, methods=['post', 'delete'], url_path='subscribe',
             permission_classes=[IsAuthenticated])
+    @transaction.atomic
     def subscribe(self, request, id=None):
         author = get_object_or_404(User, id=id)
         subscribe_data = {
@@ -77,37 +147,88 @@ class CustomUserViewSet(UserViewSet):
             Subscribe.objects.create(user=user, author=author)
 
             return Response(
-                serializer.data, status=status.HTTP_201_CREATED)
+                serializer_data(serializer), status=status.HTTP_201_CREATED)
 
         get_object_or_404(
             Subscribe, user=request.user, author=author).delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def get_recipes_limit(request):
+        limit = request.query_params.get('recipes_limit')
+        if not limit:
+            return None
+        try:
+            return serializers.IntegerField(min_value=0).run_validation(limit)
+        except ValidationError as error:
+            raise ValidationError({'recipes_limit': error.detail})
+
     @action(detail=False, methods=['get'], url_path='subscriptions',
             permission_classes=[IsAuthenticated])
     def subscribe_list(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        recipes = Recipe.objects.all()
+        limit = self.get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes.annotate(row_number=Window(
+                RowNumber(), partition_by=F('author'),
+                order_by=F('created').desc(),
+            )).filter(row_number__lte=limit)
+        queryset = User.objects.filter(
+            following__user=request.user,
+        ).annotate(
+            is_subscribed=Value(True),
+        ).order_by('username').prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recipes_preview'))
         pages = self.paginate_queryset(queryset)
         serializer = SubscribeListSerializer(
             pages, many=True, context={'request': request})
 
-        return self.get_paginated_response(serializer.data)
+        return self.get_paginated_response(serializer_data(serializer))
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     filter_backends = (DjangoFilterBackend, )
     permission_classes = (IsAuthorOrReadOnly, )
     pagination_class = CustomPagination
     filterset_class = RecipeFilter
 
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, LimitedUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Recipe.objects.with_user_annotations(
+            self.request.user).with_related()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    def feed_page(self, user):
+        """Страница ленты подписок: запросом по подпискам или из FeedItem."""
+        if settings.FEED_STRATEGY != 'fanout':
+            return self.paginate_queryset(self.get_queryset().feed(user))
+        items = self.paginate_queryset(FeedItem.objects.filter(user=user))
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in items])
+
+        return [recipes[item.recipe_id] for item in items
+                if item.recipe_id in recipes]
+
+    @action(detail=False, methods=['get'], url_path='feed',
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        serializer = RecipeReadSerializer(
+            self.feed_page(request.user), many=True,
+            context={'request': request})
+
+        return self.get_paginated_response(serializer_data(serializer))
+
     @staticmethod
+    @transaction.atomic
     def add_to(serializer_class, request, pk):
         context = {'request': request}
         recipe = get_object_or_404(Recipe, id=pk)
@@ -119,9 +240,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         serializer.save()
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(
+            serializer_data(serializer), status=status.HTTP_201_CREATED)
 
     @staticmethod
+    @transaction.atomic
     def del_from(model, request, pk):
         get_object_or_404(model, user=request.user,
                           recipe=get_object_or_404(Recipe, id=pk)).delete()
@@ -144,27 +267,37 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.del_from(ShoppingCart, request, pk)
 
     @staticmethod
-    def download_shopping_list(ingredients):
-        shopping_list = 'Список покупок:\n'
-        for ingredient in ingredients:
-            shopping_list += (
-                f'\n  - {ingredient["ingredient__name"]}: '
-                f'{ingredient["amount"]} '
-                f'({ingredient["ingredient__measurement_unit"]})'
-            )
-        filename = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+    def download_shopping_list(stream, renderer):
+        response = StreamingHttpResponse(
+            stream, content_type=renderer.media_type)
+        filename = f'shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename = {filename}'
 
         return response
 
+    @staticmethod
+    def shopping_list_etag(renderer, state):
+        updated = state['updated'].timestamp() if state['updated'] else 0
+        return quote_etag(f'{renderer.format}-{state["count"]}-{updated}')
+
+    @staticmethod
+    def shopping_list_rows(items):
+        return items.order_by('ingredient__name').values(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount')
+
     @action(detail=False, methods=['get'], url_path='download_shopping_cart',
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def make_shopping_list(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user).order_by(
-            'ingredient__name').values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            amount=Sum('amount'))
+        renderer = request.accepted_renderer
+        items = ShoppingListItem.objects.filter(user=request.user)
+        etag = self.shopping_list_etag(renderer, items.aggregate(
+            count=Count('id'), updated=Max('updated')))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.download_shopping_list(renderer.stream(
+                self.shopping_list_rows(items).iterator()), renderer)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
 
-        return self.download_shopping_list(ingredients)
+        return response
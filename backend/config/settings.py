@@ -24,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -37,6 +38,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
+    'api.nplusone.NPlusOneMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,7 +51,11 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
-ROOT_URLCONF = 'config.urls'
+# Асинхронные представления для чтения рецептов, тегов, ингредиентов
+# и списка покупок. Включаются по умолчанию при запуске через config.asgi.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+ROOT_URLCONF = 'config.async_urls' if ASYNC_VIEWS else 'config.urls'
 
 TEMPLATES = [
     {
@@ -72,6 +80,21 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # POSTGRES DATABASE
 #####################
 
+# direct - постоянные соединения напрямую с Postgres, pgbouncer -
+# соединения через PgBouncer в режиме transaction pooling.
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'direct')
+
+# Те же переменные читает gunicorn.conf.py.
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 3))
+
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 1))
+
+# Django держит одно соединение на поток, поэтому соединений у воркера
+# столько же, сколько потоков.
+DB_POOL_SIZE = GUNICORN_THREADS
+
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))
+
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
@@ -80,9 +103,37 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'db'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Под ASGI синхронный код каждого запроса выполняется в новом
+        # потоке, и постоянные соединения оставались бы открытыми
+        # в завершённых потоках, поэтому там соединения не сохраняются.
+        'CONN_MAX_AGE': 0 if ASYNC_VIEWS else int(
+            os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # В режиме transaction pooling курсор на стороне сервера не
+        # переживает конец транзакции.
+        'DISABLE_SERVER_SIDE_CURSORS': DB_POOL_MODE == 'pgbouncer',
     }
 }
 
+# Реплики для чтения: адреса серверов Postgres, для SQLite - пути к файлам.
+DB_REPLICAS = os.getenv('DB_REPLICAS', '').split()
+
+DB_REPLICA_ALIASES = []
+
+for index, replica in enumerate(DB_REPLICAS, start=1):
+    DB_REPLICA_ALIASES.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        ('NAME' if 'sqlite3' in DATABASES['default']['ENGINE']
+         else 'HOST'): replica,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Сколько секунд после записи клиент читает из основной базы.
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+
 
 #########################
 # DJANGO REST FRAMEWORK
@@ -93,7 +144,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -125,6 +176,100 @@ DJOSER = {
 AUTH_USER_MODEL = 'users.User'
 
 
+##########
+# CACHES
+##########
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Сколько секунд пользователь по токену хранится в общем кэше
+# и в памяти процесса. Без общего кэша выход и смена пароля сбрасывали бы
+# запись только в одном воркере, поэтому остаётся только кэш процесса.
+TOKEN_CACHE_TIMEOUT = int(
+    os.getenv('TOKEN_CACHE_TIMEOUT', 300)) if REDIS_URL else 0
+
+TOKEN_CACHE_LOCAL_TIMEOUT = int(os.getenv('TOKEN_CACHE_LOCAL_TIMEOUT', 5))
+
+
+##################
+# REFERENCE DATA
+##################
+
+# Без общего кэша изменения справочников доходят до других воркеров
+# только по истечении этого срока.
+REFERENCE_DATA_TIMEOUT = int(
+    os.getenv('REFERENCE_DATA_TIMEOUT', 300 if REDIS_URL else 10))
+
+REFERENCE_DATA_MAX_AGE = int(os.getenv('REFERENCE_DATA_MAX_AGE', 60))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+
+##########
+# SEARCH
+##########
+
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
+
+########
+# FEED
+########
+
+# join - лента запросом по подпискам, fanout - из таблицы FeedItem,
+# которая заполняется при публикации рецептов и подписке.
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', 'join')
+
+FEED_BATCH_SIZE = int(os.getenv('FEED_BATCH_SIZE', 5000))
+
+
+###################
+# INSTRUMENTATION
+###################
+
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', 0.1))
+
+INSTRUMENTATION_METRICS = os.getenv('INSTRUMENTATION_METRICS') == 'True'
+
+NPLUSONE_DETECTION = os.getenv('NPLUSONE_DETECTION', str(bool(DEBUG))) == 'True'
+
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 5))
+
+NPLUSONE_RAISE = os.getenv('NPLUSONE_RAISE') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.instrumentation': {
+            'handlers': ['console'],
+            'level': os.getenv('INSTRUMENTATION_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'api.nplusone': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -169,6 +314,25 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+UPLOAD_MAX_FILE_SIZE = int(os.getenv('UPLOAD_MAX_FILE_SIZE', 10 * 2 ** 20))
+
+
+#################
+# RECIPE IMAGES
+#################
+
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP').upper()
+
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', 80))
+
+RECIPE_IMAGE_SIZES = {
+    'small': (200, 200),
+    'card': (640, 480),
+    'large': (1280, 960),
+}
+
 
 ################
 # CORS HEADERS
@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from api.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls'), name='api'),
 ]
+
+if settings.INSTRUMENTATION_METRICS:
+    urlpatterns.append(path('metrics', metrics_view, name='metrics'))
@@ -0,0 +1,8 @@
+import os
+
+bind = '0:8000'
+
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+
+# При threads больше 1 gunicorn использует воркеры gthread.
+threads = int(os.getenv('GUNICORN_THREADS', 1))
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.models import Group
 
 from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
 
 admin.site.unregister(Group)
 
@@ -32,13 +32,17 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'id', 'author', 'image', 'added_in_favorites', )
+    list_display = ('name', 'id', 'author', 'image', 'favorites_count',
+                    'in_carts_count', )
     list_filter = ('author', 'name', 'tags', )
     inlines = (TagInLine, IngredientInLine, )
 
-    @admin.display(description='В избранном')
-    def added_in_favorites(self, obj):
-        return obj.favorites.count()
+    def save_related(self, request, form, formsets, change):
+        old_amounts = form.instance.ingredient_amounts() if change else {}
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.apply_recipe_change(
+            form.instance, old_amounts)
+        Recipe.objects.filter(pk=form.instance.pk).update_search_vector()
 
 
 @admin.register(IngredientRecipe)
@@ -0,0 +1,55 @@
+from bisect import bisect_left
+from threading import Lock
+
+from . import reference
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Отсортированный в памяти процесса индекс названий ингредиентов.
+
+    Строится при первом поиске из кэша справочников и пересобирается,
+    когда меняется версия справочника ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._entries = []
+        self._keys = []
+
+    def _load(self):
+        version = reference.ingredients.version()
+        with self._lock:
+            if self._version != version:
+                entries = sorted(
+                    (name.casefold(), name, unit, pk)
+                    for pk, name, unit in reference.ingredients.rows(version))
+                self._entries = entries
+                self._keys = [entry[0] for entry in entries]
+                self._version = version
+
+            return self._entries, self._keys
+
+    def search(self, query, limit):
+        """Сначала названия, начинающиеся с query, затем содержащие его."""
+        entries, keys = self._load()
+        query = query.casefold()
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(entries[position])
+            position += 1
+        if len(found) < limit:
+            for entry in entries:
+                if query in entry[0] and not entry[0].startswith(query):
+                    found.append(entry)
+                    if len(found) == limit:
+                        break
+
+        return [Ingredient(id=pk, name=name, measurement_unit=unit)
+                for _, name, unit, pk in found]
+
+
+ingredient_index = IngredientIndex()
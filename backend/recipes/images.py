@@ -0,0 +1,117 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing import get_context
+from pathlib import PurePosixPath
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from .models import Recipe
+from .thumbnails import render
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_PATH = 'recipes/thumbnails/'
+
+
+class ImagePipeline:
+    """Уменьшенные копии изображений рецептов.
+
+    Копии создаются после фиксации транзакции в пуле из
+    RECIPE_IMAGE_WORKERS процессов, так что воркер, принявший запрос,
+    не тратит время на пересжатие. Пути к готовым копиям сохраняются
+    в Recipe.thumbnails вместе с именем исходного файла; пока копий нет,
+    отдаётся оригинал. При RECIPE_IMAGE_WORKERS=0 копии создаются
+    сразу в текущем процессе.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._executor = None
+
+    @property
+    def storage(self):
+        return Recipe._meta.get_field('image').storage
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.RECIPE_IMAGE_WORKERS,
+                    mp_context=get_context('spawn'))
+
+            return self._executor
+
+    def submit(self, *args):
+        """Отправить задачу в пул, пересоздав его, если пул сломан."""
+        try:
+            return self.executor().submit(render, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+
+            return self.executor().submit(render, *args)
+
+    def render_args(self, name):
+        """Аргументы render для файла name."""
+        with self.storage.open(name) as file:
+            data = file.read()
+
+        return (data, settings.RECIPE_IMAGE_SIZES,
+                settings.RECIPE_IMAGE_FORMAT, settings.RECIPE_IMAGE_QUALITY)
+
+    def schedule(self, recipe):
+        """Поставить создание копий в очередь, если изображение новое."""
+        name = recipe.image.name
+        if name and recipe.thumbnails.get('source') != name:
+            transaction.on_commit(partial(self.process, recipe.pk, name))
+
+    def process(self, pk, name):
+        try:
+            args = self.render_args(name)
+            if not settings.RECIPE_IMAGE_WORKERS:
+                self.store(pk, name, render(*args))
+                return
+            future = self.submit(*args)
+        except Exception:
+            logger.exception('Не удалось создать копии изображения %s', name)
+            return
+        future.add_done_callback(partial(self._done, pk, name))
+
+    def _done(self, pk, name, future):
+        try:
+            self.store(pk, name, future.result())
+        except Exception:
+            logger.exception('Не удалось создать копии изображения %s', name)
+        finally:
+            connections.close_all()
+
+    def store(self, pk, name, variants):
+        """Сохранить копии и записать их пути в рецепт.
+
+        Если изображение рецепта успело смениться, копии удаляются.
+        """
+        stem = PurePosixPath(name).stem
+        extension = settings.RECIPE_IMAGE_FORMAT.lower()
+        thumbnails = {'source': name}
+        for variant, content in variants.items():
+            thumbnails[variant] = self.storage.save(
+                f'{THUMBNAILS_PATH}{variant}/{stem}.{extension}',
+                ContentFile(content))
+        previous = Recipe.objects.filter(pk=pk).values_list(
+            'thumbnails', flat=True).first() or {}
+        updated = Recipe.objects.filter(pk=pk, image=name).update(
+            thumbnails=thumbnails)
+        stale = thumbnails if not updated else {
+            variant: path for variant, path in previous.items()
+            if path not in thumbnails.values()}
+        for variant, path in stale.items():
+            if variant != 'source':
+                self.storage.delete(path)
+
+
+image_pipeline = ImagePipeline()
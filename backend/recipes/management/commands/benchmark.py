@@ -0,0 +1,376 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from itertools import islice
+from urllib.parse import quote
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorite, FeedItem, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe)
+from users.models import Subscribe, User
+
+SIZES = {
+    'small': {
+        'users': 200, 'recipes': 1_000, 'ingredients': 500, 'dense': 200},
+    'medium': {
+        'users': 10_000, 'recipes': 10_000, 'ingredients': 2_000,
+        'dense': 1_000},
+    'large': {
+        'users': 10_000, 'recipes': 100_000, 'ingredients': 2_000,
+        'dense': 5_000},
+    'huge': {
+        'users': 50_000, 'recipes': 1_000_000, 'ingredients': 2_000,
+        'dense': 5_000},
+}
+
+INGREDIENTS_PER_RECIPE = 5
+TAGS_PER_RECIPE = 2
+BATCH_SIZE = 5_000
+IMAGE = 'recipes/images/benchmark.png'
+
+# Имя, url и признак постраничного эндпоинта: для них url содержит {limit},
+# а количество запросов не должно зависеть от размера страницы.
+ENDPOINTS = (
+    ('recipe_list', '/api/recipes/?limit={limit}', True),
+    ('recipe_list_filtered',
+     '/api/recipes/?limit={limit}&is_favorited=1&tags=tag-0', True),
+    ('recipe_list_popular', '/api/recipes/?limit={limit}&ordering=popular',
+     True),
+    ('recipe_search', '/api/recipes/?limit={limit}&search={search}', True),
+    ('recipe_feed', '/api/recipes/feed/?limit={limit}', True),
+    ('recipe_detail', '/api/recipes/{recipe}/', False),
+    ('subscriptions',
+     '/api/users/subscriptions/?limit={limit}&recipes_limit=3', True),
+    ('download_shopping_cart', '/api/recipes/download_shopping_cart/',
+     False),
+    ('ingredient_search', '/api/ingredients/?name=ингредиент 1', False),
+    ('tag_list', '/api/tags/', False),
+    ('user_list', '/api/users/?limit={limit}', True),
+)
+
+# Эндпоинты, у которых есть async-представления (config.async_urls).
+ASYNC_ENDPOINTS = ('recipe_list', 'recipe_detail', 'download_shopping_cart',
+                   'ingredient_search', 'tag_list')
+
+
+@contextmanager
+def database_latency(seconds):
+    """Задержка перед каждым SQL-запросом во всех потоках."""
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def add_delay(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delay)
+
+    if not seconds:
+        yield
+        return
+    connection_created.connect(add_delay)
+    connection.execute_wrappers.append(delay)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_delay)
+        connection.execute_wrappers.remove(delay)
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(0, round(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    """Замер количества SQL-запросов, времени и памяти эндпоинтов API"""
+
+    help = ('Создаёт тестовую базу, наполняет её синтетическими данными '
+            'и замеряет эндпоинты API. Завершается с ошибкой, если '
+            'количество запросов растёт вместе с размером страницы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', choices=SIZES, default='small',
+            help='Объём синтетических данных')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов каждого запроса')
+        parser.add_argument(
+            '--page-size', type=int, default=50,
+            help='Размер большой страницы для проверки N+1')
+        parser.add_argument(
+            '--allow-scaling', action='append', default=[],
+            metavar='ENDPOINT',
+            help='Не считать ошибкой рост запросов для эндпоинта')
+        parser.add_argument(
+            '--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных чисел')
+        parser.add_argument(
+            '--concurrency', type=int, default=0,
+            help='Сравнить пропускную способность sync- и async-'
+                 'представлений при стольких одновременных запросах')
+        parser.add_argument(
+            '--db-latency', type=float, default=0,
+            help='Добавить к каждому SQL-запросу задержку в мс, чтобы '
+                 'сравнение пропускной способности учитывало сеть до базы')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            random.seed(options['seed'])
+            started = time.perf_counter()
+            context = self.populate(SIZES[options['size']])
+            self.stdout.write(
+                f'Данные «{options["size"]}» созданы за '
+                f'{time.perf_counter() - started:.1f} с')
+            with override_settings(INSTRUMENTATION_SAMPLE_RATE=0):
+                results = self.run_endpoints(
+                    context, options['repeat'], options['page_size'])
+                if options['concurrency']:
+                    with database_latency(options['db_latency'] / 1000):
+                        self.run_throughput(
+                            results, context, options['repeat'],
+                            options['page_size'], options['concurrency'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        if options['concurrency']:
+            self.report_throughput(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        failed = [result['name'] for result in results
+                  if result.get('scales_with_rows')
+                  and result['name'] not in options['allow_scaling']]
+        if failed:
+            raise CommandError(
+                'Количество запросов растёт с размером страницы: '
+                + ', '.join(failed))
+
+    @staticmethod
+    def bulk(model, objects):
+        objects = iter(objects)
+        while batch := list(islice(objects, BATCH_SIZE)):
+            model.objects.bulk_create(batch)
+
+    def populate(self, size):
+        tags = [Tag(name=f'Тег {index}', color=f'#{index:06x}',
+                    slug=f'tag-{index}') for index in range(6)]
+        self.bulk(Tag, tags)
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+        self.bulk(Ingredient, [
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(size['ingredients'])])
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+        self.bulk(User, [
+            User(email=f'user{index}@benchmark.local',
+                 username=f'user{index}', first_name='Имя',
+                 last_name='Фамилия', password=f'!benchmark{index}')
+            for index in range(size['users'])])
+        user_ids = list(User.objects.values_list('id', flat=True))
+
+        self.bulk(Recipe, (
+            Recipe(author_id=random.choice(user_ids), name=f'Рецепт {index}',
+                   text='Описание рецепта', image=IMAGE,
+                   cooking_time=random.randint(1, 120))
+            for index in range(size['recipes'])))
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+
+        self.bulk(TagRecipe, (
+            TagRecipe(tag_id=tag_id, recipe_id=recipe_id)
+            for recipe_id in recipe_ids
+            for tag_id in random.sample(tag_ids, TAGS_PER_RECIPE)))
+        self.bulk(IngredientRecipe, (
+            IngredientRecipe(ingredient_id=ingredient_id, recipe_id=recipe_id,
+                             amount=random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in random.sample(
+                ingredient_ids, INGREDIENTS_PER_RECIPE)))
+
+        user = User.objects.get(id=user_ids[0])
+        dense = random.sample(recipe_ids, min(size['dense'], len(recipe_ids)))
+        self.bulk(Favorite, [
+            Favorite(user=user, recipe_id=recipe_id) for recipe_id in dense])
+        self.bulk(ShoppingCart, [
+            ShoppingCart(user=user, recipe_id=recipe_id)
+            for recipe_id in dense])
+        ShoppingListItem.objects.rebuild([user.id])
+        self.bulk(Subscribe, [
+            Subscribe(user=user, author_id=author_id)
+            for author_id in random.sample(
+                user_ids[1:], min(size['dense'], len(user_ids) - 1))])
+        call_command('recount', verbosity=0)
+        Recipe.objects.update_search_vector()
+        if settings.FEED_STRATEGY == 'fanout':
+            FeedItem.objects.rebuild()
+
+        return {
+            'token': Token.objects.create(user=user).key,
+            'recipe': dense[0],
+            'search': quote(Recipe.objects.get(id=dense[0]).name),
+        }
+
+    @staticmethod
+    def request(client, url):
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{url} вернул {response.status_code}')
+
+    def measure(self, client, url, repeat):
+        self.request(client, url)
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, url)
+        query_count = len(queries)
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.request(client, url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        tracemalloc.start()
+        self.request(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'queries': query_count,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def run_endpoints(self, context, repeat, page_size):
+        client = Client(HTTP_AUTHORIZATION=f'Token {context["token"]}')
+        results = []
+        for name, url, paginated in ENDPOINTS:
+            result = {'name': name}
+            result.update(self.measure(
+                client, url.format(limit=page_size, **context), repeat))
+            if paginated:
+                single = self.measure(
+                    client, url.format(limit=1, **context), 1)
+                result['queries_single_row'] = single['queries']
+                result['scales_with_rows'] = (
+                    result['queries'] > single['queries'])
+            results.append(result)
+
+        return results
+
+    @staticmethod
+    async def arequest(client, url, headers):
+        response = await client.get(url, headers=headers)
+        if response.streaming and response.is_async:
+            async for _ in response.streaming_content:
+                pass
+        elif response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{url} вернул {response.status_code}')
+
+    async def concurrent_requests(self, client, url, headers, total,
+                                  concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            # Как ASGIHandler: у каждого запроса свой поток для sync-кода
+            # и ORM, который AsyncClient сам не создаёт.
+            async with semaphore, ThreadSensitiveContext():
+                await self.arequest(client, url, headers)
+                await sync_to_async(connections.close_all)()
+
+        await asyncio.gather(*(request() for _ in range(total)))
+
+    def run_throughput(self, results, context, repeat, page_size,
+                       concurrency):
+        """Запросов в секунду в одном процессе.
+
+        Синхронные представления обрабатывают запросы по одному, как
+        воркер gunicorn, асинхронные - по concurrency одновременно, как
+        воркер uvicorn. Пиковая память замеряется на одной пачке из
+        concurrency запросов.
+        """
+        total = repeat * concurrency
+        client = Client(HTTP_AUTHORIZATION=f'Token {context["token"]}')
+        async_client = AsyncClient()
+        headers = {'Authorization': f'Token {context["token"]}'}
+        urls = {name: url.format(limit=page_size, **context)
+                for name, url, _ in ENDPOINTS}
+        for result in results:
+            if result['name'] not in ASYNC_ENDPOINTS:
+                continue
+            url = urls[result['name']]
+
+            def run_sync(count):
+                for _ in range(count):
+                    self.request(client, url)
+
+            def run_async(count):
+                with override_settings(ROOT_URLCONF='config.async_urls'):
+                    asyncio.run(self.concurrent_requests(
+                        async_client, url, headers, count, concurrency))
+
+            for mode, run in (('sync', run_sync), ('async', run_async)):
+                run(concurrency)
+                started = time.perf_counter()
+                run(total)
+                result[f'{mode}_rps'] = round(
+                    total / (time.perf_counter() - started), 1)
+                tracemalloc.start()
+                run(concurrency)
+                result[f'{mode}_peak_kb'] = round(
+                    tracemalloc.get_traced_memory()[1] / 1024, 1)
+                tracemalloc.stop()
+
+    def report_throughput(self, results):
+        self.stdout.write(
+            f'\n{"эндпоинт":<24}{"sync, зап/с":>13}{"async, зап/с":>14}'
+            f'{"sync, КБ":>11}{"async, КБ":>11}')
+        for result in results:
+            if 'async_rps' in result:
+                self.stdout.write(
+                    f'{result["name"]:<24}{result["sync_rps"]:>13}'
+                    f'{result["async_rps"]:>14}{result["sync_peak_kb"]:>11}'
+                    f'{result["async_peak_kb"]:>11}')
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"эндпоинт":<24}{"запросы":>9}{"p50, мс":>10}'
+            f'{"p99, мс":>10}{"пик, КБ":>11}')
+        for result in results:
+            line = (
+                f'{result["name"]:<24}{result["queries"]:>9}'
+                f'{result["p50_ms"]:>10}{result["p99_ms"]:>10}'
+                f'{result["peak_kb"]:>11}')
+            if result.get('scales_with_rows'):
+                line = self.style.ERROR(
+                    f'{line}  N+1: {result["queries_single_row"]} '
+                    f'при одной строке')
+            self.stdout.write(line)
@@ -0,0 +1,57 @@
+from itertools import combinations
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api.filters import RecipeFilter
+from recipes import reference
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Планы запросов списка рецептов для всех сочетаний фильтров"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя для фильтров избранного и корзины')
+        parser.add_argument(
+            '--limit', type=int, default=6,
+            help='Размер страницы')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(
+            **({'id': options['user']} if options['user'] else {})).first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        slugs = list(reference.tags.index('slug'))[:2]
+        params = {
+            'tags': slugs,
+            'author': [str(user.id)],
+            'is_favorited': ['1'],
+            'is_in_shopping_cart': ['1'],
+        }
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = user
+        explain_options = (
+            {'analyze': True} if connection.vendor == 'postgresql' else {})
+
+        for size in range(len(params) + 1):
+            for names in combinations(params, size):
+                data = QueryDict(mutable=True)
+                for name in names:
+                    data.setlist(name, params[name])
+                filterset = RecipeFilter(
+                    data=data, request=request,
+                    queryset=Recipe.objects.with_user_annotations(user))
+                if not filterset.is_valid():
+                    raise CommandError(filterset.errors)
+                queryset = filterset.qs[:options['limit']]
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f'?{data.urlencode()}' if names else 'без фильтров'))
+                self.stdout.write(queryset.explain(**explain_options))
+                self.stdout.write('')
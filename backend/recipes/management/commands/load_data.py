@@ -1,37 +1,111 @@
+import json
 from csv import reader
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes import reference
 from recipes.models import Ingredient, Tag
 
 DATA_PATH = str(settings.BASE_DIR)[:-7] + 'data/'
 
 TABLES_DICT = {
-    Tag: 'tags.csv',
-    Ingredient: 'ingredients.csv',
+    'tags': {
+        'model': Tag,
+        'file': 'tags.csv',
+        'fields': ('name', 'color', 'slug'),
+        'conflicts': {
+            'update_conflicts': True,
+            'unique_fields': ('slug', ),
+            'update_fields': ('name', 'color'),
+        },
+        'reference': reference.tags,
+    },
+    'ingredients': {
+        'model': Ingredient,
+        'file': 'ingredients.csv',
+        'fields': ('name', 'measurement_unit'),
+        'conflicts': {'ignore_conflicts': True},
+        'reference': reference.ingredients,
+    },
 }
 
 
+def read_rows(path, fields):
+    """Построчно читает csv, json или jsonl и отдаёт словари полей."""
+    suffix = Path(path).suffix.lower()
+    with open(path, 'r', encoding='utf-8') as file:
+        if suffix == '.json':
+            rows = json.load(file)
+        elif suffix == '.jsonl':
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = (dict(zip(fields, row)) if len(row) == len(fields) else {}
+                    for row in reader(file) if row)
+        for number, row in enumerate(rows, start=1):
+            if set(row) != set(fields):
+                raise CommandError(
+                    f'{path}, строка {number}: ожидаются поля '
+                    f'{", ".join(fields)}')
+            yield {field: str(row[field]).strip() for field in fields}
+
+
 class Command(BaseCommand):
-    """Загрузка данных из csv-файлов"""
+    """Загрузка данных из csv- и json-файлов"""
+
+    def add_arguments(self, parser):
+        for name, table in TABLES_DICT.items():
+            parser.add_argument(
+                f'--{name}', metavar='PATH',
+                help=f'Файл csv, json или jsonl (по умолчанию '
+                     f'{DATA_PATH}{table["file"]})')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Количество строк в одном INSERT')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Прочитать и записать данные, затем откатить транзакцию')
 
     def handle(self, *args, **options):
-        for model, base in TABLES_DICT.items():
-            with open(f'{DATA_PATH}{base}', 'r', encoding='utf-8') as csv_file:
-                if model == Tag:
-                    for tag, color, slug in reader(csv_file):
-                        Tag.objects.get_or_create(
-                            name=tag,
-                            color=color,
-                            slug=slug
-                        )
-                    print('Теги успешно загружены')
-
-                else:
-                    for name, unit in reader(csv_file):
-                        Ingredient.objects.get_or_create(
-                            name=name,
-                            measurement_unit=unit
-                        )
-                    print('Игредиенты успешно загружены')
+        paths = {name: options[name] for name in TABLES_DICT
+                 if options[name]}
+        if not paths:
+            paths = {name: f'{DATA_PATH}{table["file"]}'
+                     for name, table in TABLES_DICT.items()}
+
+        for name, path in paths.items():
+            if not Path(path).is_file():
+                raise CommandError(f'Файл {path} не найден')
+            table = TABLES_DICT[name]
+            started = perf_counter()
+            with transaction.atomic():
+                count, added = self.load(
+                    table, path, options['chunk_size'])
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+            elapsed = perf_counter() - started
+            if not options['dry_run']:
+                table['reference'].invalidate()
+            self.stdout.write(
+                f'{table["model"]._meta.verbose_name_plural}: прочитано '
+                f'{count}, добавлено {added} за {elapsed:.2f} с '
+                f'({count / elapsed if elapsed else count:.0f} строк/с)'
+                + (' - пробный запуск, изменения отменены'
+                   if options['dry_run'] else ''))
+
+    @staticmethod
+    def load(table, path, chunk_size):
+        model = table['model']
+        before = model.objects.count()
+        rows = read_rows(path, table['fields'])
+        count = 0
+        while chunk := list(islice(rows, chunk_size)):
+            model.objects.bulk_create(
+                [model(**row) for row in chunk], **table['conflicts'])
+            count += len(chunk)
+
+        return count, model.objects.count() - before
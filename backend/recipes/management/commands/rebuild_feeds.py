@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedItem
+
+
+class Command(BaseCommand):
+    """Пересборка лент подписок для FEED_STRATEGY=fanout"""
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            FeedItem.objects.rebuild()
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                'Ленты подписок успешно пересобраны'))
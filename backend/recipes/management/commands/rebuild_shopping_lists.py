@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    """Пересчёт списков покупок по содержимому корзин"""
+
+    def handle(self, *args, **options):
+        user_ids = ShoppingCart.objects.values_list(
+            'user_id', flat=True).distinct()
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.rebuild(user_ids)
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                'Списки покупок успешно пересчитаны'))
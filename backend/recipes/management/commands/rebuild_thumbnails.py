@@ -0,0 +1,38 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from recipes.images import image_pipeline
+from recipes.models import Recipe
+from recipes.thumbnails import render
+
+
+class Command(BaseCommand):
+    """Создание уменьшенных копий изображений рецептов"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии и для рецептов, у которых они уже есть')
+
+    def handle(self, *args, **options):
+        recipes = (
+            (recipe.pk, recipe.image.name) for recipe
+            in Recipe.objects.only('image', 'thumbnails').iterator()
+            if recipe.image and (
+                options['force']
+                or recipe.thumbnails.get('source') != recipe.image.name))
+        workers = settings.RECIPE_IMAGE_WORKERS
+        count = 0
+        while chunk := list(islice(recipes, max(workers, 1) * 4)):
+            arguments = zip(*(image_pipeline.render_args(name)
+                              for _, name in chunk))
+            results = (image_pipeline.executor().map(render, *arguments)
+                       if workers else map(render, *arguments))
+            for (pk, name), variants in zip(chunk, results):
+                image_pipeline.store(pk, name, variants)
+            count += len(chunk)
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Копии изображений созданы для рецептов: {count}'))
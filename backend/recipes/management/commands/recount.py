@@ -0,0 +1,47 @@
+from functools import reduce
+from operator import or_
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscribe, User
+
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'in_carts_count': (ShoppingCart, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Subscribe, 'author'),
+    },
+}
+
+
+def actual_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(count=Count('pk')).values('count')), 0)
+
+
+class Command(BaseCommand):
+    """Пересчёт счётчиков избранного, корзин, рецептов и подписчиков"""
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, counters in COUNTERS.items():
+                actual = {f'actual_{name}': actual_count(*source)
+                          for name, source in counters.items()}
+                drifted = model.objects.annotate(**actual).filter(reduce(
+                    or_, (~Q(**{name: F(f'actual_{name}')})
+                          for name in counters))).count()
+                model.objects.update(**{
+                    name: actual_count(*source)
+                    for name, source in counters.items()})
+                if options['verbosity']:
+                    self.stdout.write(
+                        f'{model._meta.verbose_name_plural}: исправлено '
+                        f'счётчиков у {drifted}')
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+from django.db.models import Max, Min
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Пересчёт поисковых векторов рецептов"""
+
+    help = ('Заполняет search_vector у всех рецептов порциями по id. '
+            'Нужна после миграции и при смене SEARCH_CONFIG.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10_000,
+            help='Количество рецептов в одном UPDATE')
+
+    def handle(self, *args, **options):
+        bounds = Recipe.objects.aggregate(first=Min('id'), last=Max('id'))
+        batch_size = options['batch_size']
+        updated = 0
+        if bounds['first'] is not None:
+            for start in range(bounds['first'], bounds['last'] + 1,
+                               batch_size):
+                updated += Recipe.objects.filter(
+                    id__gte=start, id__lt=start + batch_size,
+                ).update_search_vector()
+        if options['verbosity']:
+            self.stdout.write(f'Обновлено рецептов: {updated}')
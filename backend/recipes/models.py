@@ -1,7 +1,16 @@
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import (Case, Exists, F, OuterRef, Q, Subquery, Sum,
+                              Value, When)
+from django.utils import timezone
 
-from users.models import User
+from users.models import CountersMixin, Subscribe, User
 
 
 class Tag(models.Model):
@@ -55,7 +64,76 @@ class Ingredient(models.Model):
         return f'{self.name}, ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_annotations(self, user):
+        """Флаги избранного, корзины и подписки на автора для user."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags', 'recipe_ingredients__ingredient')
+
+    def feed(self, user):
+        """Рецепты авторов, на которых подписан user."""
+        return self.filter(author__following__user=user)
+
+    def popular(self):
+        return self.order_by('-favorites_count', '-created', '-id')
+
+    def search(self, query):
+        """Поиск по названию, ингредиентам и описанию рецепта.
+
+        На Postgres - по search_vector с сортировкой по SearchRank, на
+        остальных базах каждое слово запроса ищется через icontains.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(query, config=settings.SEARCH_CONFIG,
+                                search_type='websearch')
+            return self.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query),
+            ).order_by('-rank', '-created', '-id')
+        queryset = self
+        for word in query.split():
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word)
+                | Exists(IngredientRecipe.objects.filter(
+                    recipe=OuterRef('pk'), ingredient__name__icontains=word)))
+
+        return queryset
+
+    def update_search_vector(self):
+        """Пересчитать search_vector одним UPDATE (только на Postgres)."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredient_names = IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk'),
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' '),
+        ).values('names')
+        config = settings.SEARCH_CONFIG
+
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector(Subquery(ingredient_names), weight='B',
+                           config=config)
+            + SearchVector('text', weight='C', config=config)))
+
+
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -85,6 +163,12 @@ class Recipe(models.Model):
         'Изображение',
         upload_to='recipes/images/',
     )
+    thumbnails = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
         validators=[MinValueValidator(
@@ -94,15 +178,58 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'in_carts_count')
 
     class Meta:
         ordering = ('-created', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                name='recipe_created_id_idx',
+                fields=('-created', '-id')),
+            models.Index(
+                name='recipe_author_created_idx',
+                fields=('author', '-created', '-id')),
+            models.Index(
+                name='recipe_popular_idx',
+                fields=('-favorites_count', '-created', '-id')),
+        ]
 
     def __str__(self):
         return self.name
 
+    def image_url(self, variant):
+        """Ссылка на копию изображения, пока её нет - на оригинал."""
+        if not self.image:
+            return None
+        name = self.image.name
+        if self.thumbnails.get('source') == name:
+            name = self.thumbnails.get(variant, name)
+
+        return self.image.storage.url(name)
+
+    def ingredient_amounts(self):
+        return dict(self.recipe_ingredients.filter(
+            ingredient__isnull=False).values_list('ingredient_id', 'amount'))
+
 
 class TagRecipe(models.Model):
     tag = models.ForeignKey(
@@ -123,6 +250,9 @@ class TagRecipe(models.Model):
     class Meta:
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецепта'
+        indexes = [models.Index(
+            name='tagrecipe_tag_recipe_idx',
+            fields=('tag', 'recipe'))]
 
     def __str__(self):
         return f'У рецепта {self.recipe} тег - {self.tag}'
@@ -201,3 +331,169 @@ class ShoppingCart(UserRecipeBaseModel):
         default_related_name = 'shopping_cart'
         verbose_name = 'Рецепт в корзине'
         verbose_name_plural = 'Рецепты в корзине'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def change_amounts(self, user_ids, deltas):
+        """Прибавляет deltas {id ингредиента: количество} к спискам покупок.
+
+        Отрицательные значения уменьшают количество, позиции с нулевым
+        остатком удаляются.
+        """
+        deltas = {
+            ingredient_id: delta for ingredient_id, delta in deltas.items()
+            if delta}
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        self.bulk_create([
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=0)
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ], ignore_conflicts=True)
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        items.update(
+            amount=F('amount') + Case(
+                *[When(ingredient_id=ingredient_id, then=Value(delta))
+                  for ingredient_id, delta in deltas.items()],
+                default=Value(0)),
+            updated=timezone.now(),
+        )
+        items.filter(amount__lte=0).delete()
+
+    def apply_recipe_change(self, recipe, old_amounts, new_amounts=None):
+        """Переносит изменение состава рецепта в списки покупок."""
+        if new_amounts is None:
+            new_amounts = recipe.ingredient_amounts()
+        self.change_amounts(
+            ShoppingCart.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True),
+            {ingredient_id: (new_amounts.get(ingredient_id, 0)
+                             - old_amounts.get(ingredient_id, 0))
+             for ingredient_id in old_amounts.keys() | new_amounts.keys()},
+        )
+
+    def rebuild(self, user_ids):
+        """Пересчитывает списки покупок по содержимому корзин."""
+        user_ids = list(user_ids)
+        self.filter(user_id__in=user_ids).delete()
+        items = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user_id__in=user_ids,
+            ingredient__isnull=False,
+        ).values(
+            'ingredient_id', user_id=F('recipe__shopping_cart__user_id'),
+        ).annotate(amount=Sum('amount'))
+        self.bulk_create([ShoppingListItem(**item) for item in items])
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        'Количество',
+    )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Продукт в списке покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [models.UniqueConstraint(
+            name='unique_shopping_list_item',
+            fields=('user', 'ingredient'))]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} у {self.user}'
+
+
+class FeedItemQuerySet(models.QuerySet):
+
+    def add_recipe(self, recipe):
+        """Добавляет новый рецепт в ленты подписчиков автора."""
+        followers = Subscribe.objects.filter(
+            author_id=recipe.author_id).values_list('user_id', flat=True)
+        self.bulk_create([
+            FeedItem(user_id=user_id, recipe=recipe, created=recipe.created)
+            for user_id in followers.iterator()
+        ], batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+
+    def follow(self, user_id, author_id):
+        """Добавляет в ленту рецепты автора, на которого подписались."""
+        recipes = Recipe.objects.filter(
+            author_id=author_id).values_list('id', 'created')
+        self.bulk_create([
+            FeedItem(user_id=user_id, recipe_id=recipe_id, created=created)
+            for recipe_id, created in recipes.iterator()
+        ], batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+
+    def unfollow(self, user_id, author_id):
+        """Убирает из ленты рецепты автора, от которого отписались."""
+        self.filter(user_id=user_id, recipe__author_id=author_id).delete()
+
+    def rebuild(self):
+        """Пересобирает все ленты по подпискам."""
+        self.all().delete()
+        items = Subscribe.objects.filter(
+            author__recipes__isnull=False,
+        ).values_list(
+            'user_id', 'author__recipes__id', 'author__recipes__created',
+        ).iterator()
+        while batch := list(islice(items, settings.FEED_BATCH_SIZE)):
+            self.bulk_create([
+                FeedItem(user_id=user_id, recipe_id=recipe_id,
+                         created=created)
+                for user_id, recipe_id, created in batch])
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя (FEED_STRATEGY=fanout)."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+    )
+    created = models.DateTimeField(
+        'Дата публикации рецепта',
+    )
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created', '-recipe_id')
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [models.UniqueConstraint(
+            name='unique_feed_item',
+            fields=('user', 'recipe'))]
+        indexes = [models.Index(
+            name='feeditem_user_created_idx',
+            fields=('user', '-created', '-recipe_id'))]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
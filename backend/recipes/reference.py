@@ -0,0 +1,108 @@
+from hashlib import sha1
+from threading import Lock
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .models import Ingredient, Tag
+
+
+class ReferenceData:
+    """Версионированный кэш небольшой, почти неизменной таблицы.
+
+    Строки таблицы хранятся в кэше Django под текущей версией. Версия
+    складывается из количества строк и наибольшего id в базе, поэтому
+    добавление и удаление строки видят все воркеры, и из метки в кэше,
+    которую сигналы меняют при изменении строки. Внутри процесса
+    дополнительно держатся готовые объекты и словари для поиска по полям,
+    пересобираемые при смене версии. ETag считается по содержимому строк
+    и совпадает у всех воркеров с одинаковыми данными.
+
+    Без общего кэша метка своя у каждого воркера, и изменённая строка
+    доходит до других воркеров за REFERENCE_DATA_TIMEOUT. Значения,
+    которых нет в кэше, проверяются по базе (см. refresh).
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.key = f'reference:{model._meta.label_lower}'
+        self.version_key = f'{self.key}:version'
+        self._lock = Lock()
+        self._local = None
+
+    def version(self):
+        state = self.model.objects.aggregate(count=Count('pk'), last=Max('pk'))
+        revision = cache.get_or_set(
+            self.version_key, time_ns, settings.REFERENCE_DATA_TIMEOUT)
+
+        return f'{state["count"]}-{state["last"]}-{revision}'
+
+    def invalidate(self):
+        cache.set(
+            self.version_key, time_ns(), settings.REFERENCE_DATA_TIMEOUT)
+
+    def rows(self, version=None):
+        version = version or self.version()
+        rows = cache.get(self.key, version=version)
+        if rows is None:
+            rows = list(self.model.objects.values_list(*self.fields))
+            cache.set(self.key, rows, settings.REFERENCE_DATA_TIMEOUT,
+                      version=version)
+
+        return rows
+
+    def _state(self):
+        version = self.version()
+        with self._lock:
+            if self._local is None or self._local['version'] != version:
+                database = self.model.objects.db
+                rows = self.rows(version)
+                objects = [self.model.from_db(database, self.fields, row)
+                           for row in rows]
+                self._local = {
+                    'version': version, 'objects': objects, 'indexes': {},
+                    'etag': sha1(repr(rows).encode()).hexdigest()}
+
+            return self._local
+
+    def all(self):
+        return self._state()['objects']
+
+    def etag(self):
+        return self._state()['etag']
+
+    def index(self, field='pk'):
+        state = self._state()
+        with self._lock:
+            if field not in state['indexes']:
+                state['indexes'][field] = {
+                    getattr(obj, field): obj for obj in state['objects']}
+
+            return state['indexes'][field]
+
+    def refresh(self, field, values):
+        """Словарь по field, перечитанный, если values есть только в базе."""
+        index = self.index(field)
+        missing = {value for value in values if value not in index}
+        if not missing or not self.model.objects.filter(
+                **{f'{field}__in': missing}).exists():
+            return index
+        self.invalidate()
+
+        return self.index(field)
+
+    def get(self, pk):
+        """Объект по первичному ключу или None."""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+
+        return self.refresh('pk', [pk]).get(pk)
+
+
+tags = ReferenceData(Tag, ('id', 'name', 'color', 'slug'))
+ingredients = ReferenceData(Ingredient, ('id', 'name', 'measurement_unit'))
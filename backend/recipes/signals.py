@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Subscribe, User
+
+from . import reference
+from .images import image_pipeline
+from .models import (Favorite, FeedItem, Ingredient, Recipe, ShoppingCart,
+                     ShoppingListItem, Tag)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменить счётчик, не опуская его ниже нуля."""
+    model.objects.filter(pk=pk, **{f'{field}__gte': -delta}).update(
+        **{field: F(field) + delta})
+
+
+def cascaded(sender, origin):
+    """Строка sender удаляется каскадом от удаления другой модели.
+
+    Такие удаления обрабатывают сигналы Recipe и User один раз на всё
+    удаление, а не на каждую строку.
+    """
+    return (origin is not None
+            and getattr(origin, 'model', type(origin)) is not sender)
+
+
+def create_extensions(sender, using, **kwargs):
+    """pg_trgm нужен триграммным индексам и поиску по похожести."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+# GIN-индексы есть только на Postgres, поэтому их нет в Meta.indexes:
+# иначе состояние моделей и миграции зависели бы от базы окружения.
+POSTGRES_INDEXES = (
+    ('recipe_search_idx', Recipe, 'search_vector', None),
+    ('ingredient_name_trgm_idx', Ingredient, 'name', 'gin_trgm_ops'),
+    ('user_username_trgm_idx', User, 'username', 'gin_trgm_ops'),
+)
+
+
+def create_postgres_indexes(sender, using, **kwargs):
+    """Создаёт POSTGRES_INDEXES после применения миграций."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for name, model, field, opclass in POSTGRES_INDEXES:
+            column = quote_name(model._meta.get_field(field).column)
+            if opclass:
+                column = f'{column} {opclass}'
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {quote_name(name)} '
+                f'ON {quote_name(model._meta.db_table)} USING gin ({column})')
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.change_amounts(
+            [instance.user_id], instance.recipe.ingredient_amounts())
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, origin=None, **kwargs):
+    if cascaded(sender, origin):
+        return
+    ShoppingListItem.objects.change_amounts(
+        [instance.user_id],
+        {ingredient_id: -amount for ingredient_id, amount
+         in instance.recipe.ingredient_amounts().items()})
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    ShoppingListItem.objects.apply_recipe_change(
+        instance, instance.ingredient_amounts(), {})
+
+
+@receiver(pre_delete, sender=User)
+def decrement_user_counters(sender, instance, **kwargs):
+    """Счётчики чужих рецептов и авторов, которых касался пользователь."""
+    for model, field, pks in (
+        (Recipe, 'favorites_count',
+         Favorite.objects.filter(user=instance).values('recipe_id')),
+        (Recipe, 'in_carts_count',
+         ShoppingCart.objects.filter(user=instance).values('recipe_id')),
+        (User, 'followers_count',
+         Subscribe.objects.filter(user=instance).values('author_id')),
+    ):
+        model.objects.filter(pk__in=pks, **{f'{field}__gt': 0}).update(
+            **{field: F(field) - 1})
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, origin=None, **kwargs):
+    if cascaded(sender, origin):
+        return
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def increment_in_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'in_carts_count', 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_in_carts_count(sender, instance, origin=None, **kwargs):
+    if cascaded(sender, origin):
+        return
+    change_counter(Recipe, instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, origin=None, **kwargs):
+    if cascaded(sender, origin):
+        return
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Subscribe)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Subscribe)
+def decrement_followers_count(sender, instance, origin=None, **kwargs):
+    if cascaded(sender, origin):
+        return
+    change_counter(User, instance.author_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def add_to_feeds(sender, instance, created, **kwargs):
+    if created and settings.FEED_STRATEGY == 'fanout':
+        FeedItem.objects.add_recipe(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def add_author_to_feed(sender, instance, created, **kwargs):
+    if created and settings.FEED_STRATEGY == 'fanout':
+        FeedItem.objects.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def remove_author_from_feed(sender, instance, origin=None, **kwargs):
+    if settings.FEED_STRATEGY == 'fanout' and not cascaded(sender, origin):
+        FeedItem.objects.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Recipe)
+def create_thumbnails(sender, instance, **kwargs):
+    image_pipeline.schedule(instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    reference.tags.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    reference.ingredients.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_recipes_search_vector(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update_search_vector()
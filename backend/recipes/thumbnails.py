@@ -0,0 +1,30 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+ALPHA_MODES = ('RGBA', 'LA', 'PA')
+
+
+def render(data, sizes, image_format, quality):
+    """Уменьшенные копии изображения в формате image_format.
+
+    Выполняется в дочернем процессе, поэтому модуль не импортирует
+    Django: на вход - байты исходного файла, на выход - словарь
+    {название размера: байты копии}. Копии не бывают больше оригинала.
+    """
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        alpha = (image.mode in ALPHA_MODES
+                 or 'transparency' in image.info)
+        image = image.convert(
+            'RGBA' if alpha and image_format == 'WEBP' else 'RGB')
+
+    variants = {}
+    for name, size in sizes.items():
+        copy = image.copy()
+        copy.thumbnail(size, Image.LANCZOS)
+        output = BytesIO()
+        copy.save(output, image_format, quality=quality, optimize=True)
+        variants[name] = output.getvalue()
+
+    return variants
@@ -2,7 +2,25 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Модель со счётчиками, которые сигналы меняют через F().
+
+    Обычное сохранение существующей записи не пишет счётчики: экземпляр
+    мог быть загружен до их изменения и затёр бы новые значения.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     email = models.EmailField(
         'Адрес электронной почты',
         max_length=254,
@@ -26,7 +44,18 @@ class User(AbstractUser):
         max_length=150,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Кол-во рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчики',
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'email'
+    counter_fields = ('recipes_count', 'followers_count')
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
 
     class Meta: